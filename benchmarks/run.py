@@ -0,0 +1,293 @@
+"""
+Benchmark the Illustrator elements and primitives on synthetic render passes.
+
+Example:
+    python -m benchmarks.run --resolutions 1080p 4k --save-baseline baseline.json
+    python -m benchmarks.run --resolutions 1080p 4k --baseline baseline.json
+
+Each benchmark is run --repeat times and the fastest time is reported. Given a baseline from an earlier run (on the
+same machine), benchmarks which have slowed by more than the tolerance are reported as regressions and the exit status
+is non-zero. Baselines are machine specific, so none are committed: save one before making changes.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+import svgwrite
+from skimage import measure
+
+from benchmarks.scenes import RESOLUTIONS, SCENES, write_passes
+from blender_hand_drawn_npr.model.data import settings_from_dict
+from blender_hand_drawn_npr.model.elements import Silhouette, InternalEdges, Streamlines, Stipples
+from blender_hand_drawn_npr.model.fitting import fit_curve
+from blender_hand_drawn_npr.model import node_placement
+from blender_hand_drawn_npr.model.illustrate import Illustrator, PASS_FILENAMES
+from blender_hand_drawn_npr.model.primitives import Path, Curve1D, IsoContours
+from blender_hand_drawn_npr.model.third_party import PathFitter as pf
+from blender_hand_drawn_npr.model.third_party.variable_density import moving_front_nodes
+
+logger = logging.getLogger(__name__)
+
+
+def best_time(function, repeat, setup=None):
+    """
+    :param function: Function to time, called with the result of setup.
+    :param repeat: Number of times to call the function.
+    :param setup: Optional function called before each timed call, whose result is passed to function.
+    :return: Fastest wall time of the calls, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        # Stipple placement is random, fix it so that every run does the same work.
+        np.random.seed(0)
+        start = time.perf_counter()
+        function(arg) if setup is not None else function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def scene_passes(scene, resolution, work_dir):
+    """
+    :return: Directory holding the passes of the scene, which are generated only if not already present.
+    """
+    in_path = os.path.join(work_dir, "{}_{}".format(scene, resolution))
+    if not all(os.path.exists(os.path.join(in_path, filename.format(1))) for filename in PASS_FILENAMES.values()):
+        logger.info("Generating passes: %s", in_path)
+        write_passes(SCENES[scene](*RESOLUTIONS[resolution]), in_path)
+    return in_path
+
+
+def element_benchmarks(settings, repeat):
+    """
+    :return: Dict mapping benchmark name to time, for loading the passes and for each element.
+    """
+    results = OrderedDict()
+    results["load"] = best_time(lambda: Illustrator(settings), repeat)
+
+    surface = Illustrator(settings).surface
+
+    def silhouette():
+        element = Silhouette(surface=surface, settings=settings)
+        element.generate()
+        return element
+
+    results["silhouette"] = best_time(silhouette, repeat)
+    results["internal_edges"] = best_time(lambda: InternalEdges(surface=surface, settings=settings).generate(),
+                                          repeat)
+    results["streamlines"] = best_time(lambda: Streamlines(surface=surface, settings=settings).generate(), repeat)
+
+    boundary_curves = silhouette().boundary_curves
+    clip_path = svgwrite.Drawing().clipPath(id="silhouette_clip_path")
+    results["stipples"] = best_time(lambda: Stipples(clip_path=clip_path, intersect_boundaries=boundary_curves,
+                                                     surface=surface, settings=settings).generate(), repeat)
+    return results
+
+
+def surface_benchmarks(settings, repeat):
+    """
+    :return: Dict mapping benchmark name to time, for compacting the surface and for reading it with each layout:
+             one array per channel, or all channels stacked in one (H, W, C) array.
+    """
+    results = OrderedDict()
+    surfaces = OrderedDict((("separate", Illustrator(settings._replace(compact_surface=False)).surface),
+                            ("compact", Illustrator(settings._replace(compact_surface=False)).surface)))
+    results["surface.compact"] = best_time(surfaces["compact"].compact, 1)
+
+    for layout, surface in surfaces.items():
+        rows, cols = np.nonzero(surface.obj_image)
+        intensity = np.mean(surface.channel_range("u"))
+        results["surface.at_points." + layout] = best_time(lambda: surface.at_points(cols, rows), repeat)
+        results["surface.find_contours." + layout] = best_time(
+            lambda: measure.find_contours(surface.u_image, intensity), repeat)
+        results["streamlines." + layout] = best_time(
+            lambda: Streamlines(surface=surface, settings=settings).generate(), repeat)
+    return results
+
+
+def primitive_benchmarks(settings, repeat):
+    """
+    :return: Dict mapping benchmark name to time, for each of the primitive operations applied to the silhouette
+             and to a streamline.
+    """
+    results = OrderedDict()
+    surface = Illustrator(settings).surface
+
+    contour = max(measure.find_contours(surface.obj_image, 0.99), key=len)
+    path = Path([[coord[1], coord[0]] for coord in contour])
+    rounded = path.round()
+    bumped = rounded.bump(surface)
+    hifi_path = bumped.remove_dupes().simple_cull(settings.cull_factor)
+    fit_path = hifi_path.optimise(settings.optimise_factor)
+
+    results["path.find_corners"] = best_time(
+        lambda: path.find_corners(surface.obj_image, settings.harris_min_distance, settings.subpix_window_size),
+        repeat)
+    results["path.round"] = best_time(path.round, repeat)
+    results["path.bump"] = best_time(lambda: rounded.bump(surface), repeat)
+    results["path.bump_z"] = best_time(lambda: rounded.bump_z(surface), repeat)
+    results["path.remove_dupes"] = best_time(bumped.remove_dupes, repeat)
+    results["path.simple_cull"] = best_time(lambda: bumped.simple_cull(settings.cull_factor), repeat)
+    results["path.optimise"] = best_time(lambda: hifi_path.optimise(settings.optimise_factor), repeat)
+    results["path.compute_offset_vector"] = best_time(
+        lambda: hifi_path.compute_offset_vector(surface, settings.silhouette_thickness_parameters), repeat)
+
+    # A streamline of constant u, across the middle of the subject.
+    u_image, v_image = surface.u_image, surface.v_image
+    intensity = (u_image.max() - u_image.min()) / 2
+    u_contour = max(measure.find_contours(u_image, intensity), key=len)
+    u_path = Path([[coord[1], coord[0]] for coord in u_contour]).round().bump(surface).remove_dupes()
+    results["path.trim_uv"] = best_time(
+        lambda: u_path.trim_uv(intensity, u_image, v_image, settings.uv_primary_trim_size,
+                               settings.uv_secondary_trim_size, surface.channel_range("v")), repeat)
+
+    # Contours at every streamline intensity, by searching the whole image for each and through a tile index.
+    intensities = np.linspace(u_image.min(), u_image.max(), settings.streamline_segments + 1)[1:-1]
+    results["find_contours"] = best_time(
+        lambda: [measure.find_contours(u_image, level) for level in intensities], repeat)
+
+    def iso_contours():
+        index = IsoContours(u_image)
+        return [index.find_contours(level) for level in intensities]
+
+    results["iso_contours"] = best_time(iso_contours, repeat)
+
+    results["pathfitter.fitpath"] = best_time(lambda: pf.fitpath(fit_path.points, settings.curve_fit_error), repeat)
+    results["fitting.fit_curve"] = best_time(lambda: fit_curve(fit_path.array, settings.curve_fit_error), repeat)
+    results["curve1d"] = best_time(lambda: Curve1D(fit_path=fit_path, settings=settings), repeat)
+    curve = Curve1D(fit_path=fit_path, settings=settings)
+    results["curve1d.offset"] = best_time(
+        lambda: curve.offset(interval=settings.curve_sampling_interval, hifi_path=hifi_path,
+                             thickness_parameters=settings.silhouette_thickness_parameters, surface=surface), repeat)
+
+    # Node placement with the stipple density function, driven by the diffuse lighting of the subject.
+    stipple_parameters = settings.stipple_parameters
+    reference_image = (1 - surface.diffdir_image) * (surface.obj_image != 0)
+
+    def density_function(x, y):
+        return np.maximum(stipple_parameters.density_fn_min,
+                          (reference_image[int(round(y)), int(round(x))] ** stipple_parameters.density_fn_exponent) *
+                          stipple_parameters.density_fn_factor)
+
+    y_res, x_res = reference_image.shape
+    results["moving_front_nodes"] = best_time(lambda: moving_front_nodes(density_function,
+                                                                         (0, 0, x_res - 1, y_res - 1)), repeat)
+    radius_image = 1 / np.sqrt(np.maximum(stipple_parameters.density_fn_min,
+                                          (reference_image ** stipple_parameters.density_fn_exponent) *
+                                          stipple_parameters.density_fn_factor))
+    results["node_placement.moving_front_nodes"] = best_time(lambda: node_placement.moving_front_nodes(radius_image),
+                                                             repeat)
+    return results
+
+
+def run(scenes, resolutions, repeat, work_dir, settings_values=None):
+    """
+    :return: Dict mapping "<scene>/<resolution>/<benchmark>" to time in seconds.
+    """
+    results = OrderedDict()
+    for scene in scenes:
+        for resolution in resolutions:
+            in_path = scene_passes(scene, resolution, work_dir)
+            values = dict(settings_values or {},
+                          enable_internal_edges=True, enable_streamlines=True, enable_stipples=True,
+                          cache_passes=False, write_report=False,
+                          in_path=in_path, out_filepath=os.path.join(in_path, "out.svg"))
+            settings = settings_from_dict(values)
+
+            for benchmarks in (element_benchmarks, surface_benchmarks, primitive_benchmarks):
+                for name, seconds in benchmarks(settings, repeat).items():
+                    key = "/".join((scene, resolution, name))
+                    results[key] = seconds
+                    print("{:<50} {:>10.4f} s".format(key, seconds))
+                    sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """
+    :param results: Dict of times from this run.
+    :param baseline: Dict of times from the baseline run.
+    :param tolerance: Fractional slow-down above which a benchmark is considered to have regressed.
+    :param min_delta: Slow-down in seconds below which differences are ignored as noise.
+    :return: Names of the regressed benchmarks.
+    """
+    regressions = []
+    print()
+    print("{:<50} {:>10} {:>10} {:>8}".format("benchmark", "baseline", "current", "ratio"))
+    for key, seconds in results.items():
+        if key not in baseline:
+            continue
+        ratio = seconds / baseline[key] if baseline[key] else float("inf")
+        regressed = ratio > 1 + tolerance and seconds - baseline[key] > min_delta
+        print("{:<50} {:>10.4f} {:>10.4f} {:>7.2f}x{}".format(key, baseline[key], seconds, ratio,
+                                                             "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run",
+                                     description="Benchmark the Illustrator on synthetic render passes.")
+    parser.add_argument("--scenes", nargs="+", choices=sorted(SCENES), default=sorted(SCENES))
+    parser.add_argument("--resolutions", nargs="+", choices=sorted(RESOLUTIONS), default=["1080p"])
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs of each benchmark, of which the fastest is reported (default: 3)")
+    parser.add_argument("--settings",
+                        help="JSON settings file, as for the command-line interface")
+    parser.add_argument("--work-dir",
+                        help="Directory in which generated passes are kept for re-use. By default a temporary "
+                             "directory is used")
+    parser.add_argument("--baseline",
+                        help="JSON file of baseline times to compare against")
+    parser.add_argument("--save-baseline",
+                        help="Write the times of this run to a JSON file, for use as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Fractional slow-down reported as a regression (default: 0.25)")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="Slow-down in seconds below which differences are ignored (default: 0.005)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    settings_values = None
+    if args.settings:
+        with open(args.settings) as settings_file:
+            settings_values = json.load(settings_file)
+
+    if args.work_dir:
+        results = run(args.scenes, args.resolutions, args.repeat, args.work_dir, settings_values)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run(args.scenes, args.resolutions, args.repeat, work_dir, settings_values)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump({"machine": platform.platform(),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "results": results}, baseline_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline["results"], args.tolerance, args.min_delta)
+        if regressions:
+            print("{} regression(s) found.".format(len(regressions)))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
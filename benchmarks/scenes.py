@@ -0,0 +1,180 @@
+"""
+Synthetic render passes, computed analytically so that the Illustrator can be benchmarked without Blender.
+
+Each scene function takes the image dimensions and returns a Geometry: per-pixel object index, depth, unit normal and
+UV coordinates. Lighting passes (diffuse, shadow and AO) are derived from the geometry, and write_passes encodes all
+passes to disk as the compositor would.
+"""
+
+import os
+from collections import namedtuple
+
+import imageio
+import numpy as np
+
+from blender_hand_drawn_npr.model.illustrate import PASS_FILENAMES
+
+Geometry = namedtuple("Geometry", ["obj", "z", "norm_x", "norm_y", "norm_z", "u", "v"])
+
+RESOLUTIONS = {"1080p": (1920, 1080),
+               "4k": (3840, 2160),
+               "8k": (7680, 4320)}
+
+# Direction of the light source in camera space (x right, y up, z towards the camera).
+LIGHT_DIRECTION = np.array([-0.5, 0.4, 0.77]) / np.linalg.norm([-0.5, 0.4, 0.77])
+
+
+def normalised_coords(width, height, centre=(0.5, 0.5), radius=0.35):
+    """
+    :return: x and y image coordinates relative to the centre, scaled such that radius (as a fraction of the smaller
+             image dimension) is 1. y increases upwards.
+    """
+    scale = min(width, height) * radius
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    return (x - centre[0] * width) / scale, (centre[1] * height - y) / scale
+
+
+def empty_geometry(width, height):
+    zeros = np.zeros((height, width), dtype=np.float32)
+    return Geometry(obj=zeros.copy(), z=np.ones_like(zeros), norm_x=zeros.copy(), norm_y=zeros.copy(),
+                    norm_z=zeros.copy(), u=zeros.copy(), v=zeros.copy())
+
+
+def sphere(width, height, centre=(0.5, 0.5), radius=0.35, depth=0.5):
+    x, y = normalised_coords(width, height, centre, radius)
+    r2 = x ** 2 + y ** 2
+    mask = r2 < 1
+    nz = np.sqrt(np.clip(1 - r2, 0, 1))
+
+    geometry = empty_geometry(width, height)
+    geometry.obj[mask] = 1
+    geometry.z[mask] = (depth - 0.4 * radius * nz)[mask]
+    geometry.norm_x[mask] = x[mask]
+    geometry.norm_y[mask] = y[mask]
+    geometry.norm_z[mask] = nz[mask]
+    # Longitude and latitude.
+    geometry.u[mask] = ((np.arctan2(x, nz) / np.pi + 1) / 2)[mask]
+    geometry.v[mask] = (np.arcsin(np.clip(y, -1, 1)) / np.pi + 0.5)[mask]
+    return geometry
+
+
+def torus(width, height, tube_radius=0.35):
+    """
+    A torus viewed along its axis, tilted slightly so that the inner silhouette is not concentric with the outer.
+    """
+    x, y = normalised_coords(width, height)
+    # Foreshorten y to tilt the torus about the x axis.
+    y = y / 0.85
+    rho = np.sqrt(x ** 2 + y ** 2)
+    major_radius = 1 - tube_radius
+    d = rho - major_radius
+    mask = np.abs(d) < tube_radius
+    h = np.sqrt(np.clip(tube_radius ** 2 - d ** 2, 0, None))
+    phi = np.arctan2(y, x)
+
+    geometry = empty_geometry(width, height)
+    geometry.obj[mask] = 1
+    geometry.z[mask] = (0.5 - 0.2 * h)[mask]
+    geometry.norm_x[mask] = (d * np.cos(phi) / tube_radius)[mask]
+    geometry.norm_y[mask] = (d * np.sin(phi) / tube_radius)[mask]
+    geometry.norm_z[mask] = (h / tube_radius)[mask]
+    # Angle around the major and minor circles.
+    geometry.u[mask] = ((phi / np.pi + 1) / 2)[mask]
+    geometry.v[mask] = (np.arctan2(d, h) / np.pi + 0.5)[mask]
+    return geometry
+
+
+def saddle(width, height):
+    """
+    A hyperbolic paraboloid patch with a square outline, rotated so that its corners are not axis aligned.
+    """
+    x, y = normalised_coords(width, height)
+    angle = np.radians(20)
+    s = x * np.cos(angle) + y * np.sin(angle)
+    t = -x * np.sin(angle) + y * np.cos(angle)
+    mask = (np.abs(s) < 0.9) & (np.abs(t) < 0.9)
+    height_field = 0.5 * (s ** 2 - t ** 2)
+    # Normal of z = (s^2 - t^2) / 2, rotated back into image space.
+    ns, nt, nz = -s, t, np.ones_like(s)
+    length = np.sqrt(ns ** 2 + nt ** 2 + nz ** 2)
+    nx = ns * np.cos(angle) - nt * np.sin(angle)
+    ny = ns * np.sin(angle) + nt * np.cos(angle)
+
+    geometry = empty_geometry(width, height)
+    geometry.obj[mask] = 1
+    geometry.z[mask] = (0.5 - 0.2 * height_field)[mask]
+    geometry.norm_x[mask] = (nx / length)[mask]
+    geometry.norm_y[mask] = (ny / length)[mask]
+    geometry.norm_z[mask] = (nz / length)[mask]
+    geometry.u[mask] = ((s / 0.9 + 1) / 2)[mask]
+    geometry.v[mask] = ((t / 0.9 + 1) / 2)[mask]
+    return geometry
+
+
+def multi_object(width, height):
+    """
+    Several overlapping spheres of differing size and depth, composited by depth. All share an object index, so that
+    the depth discontinuities where they overlap produce internal edges.
+    """
+    geometry = empty_geometry(width, height)
+    for centre, radius, depth in (((0.4, 0.45), 0.3, 0.8), ((0.65, 0.55), 0.2, 0.6), ((0.3, 0.7), 0.12, 0.4),
+                                  ((0.75, 0.3), 0.08, 0.3)):
+        part = sphere(width, height, centre, radius, depth)
+        # Depth test against what has already been drawn.
+        nearer = (part.obj > 0) & (part.z < geometry.z)
+        for name in Geometry._fields:
+            getattr(geometry, name)[nearer] = getattr(part, name)[nearer]
+    return geometry
+
+
+SCENES = {"sphere": sphere,
+          "torus": torus,
+          "saddle": saddle,
+          "multi_object": multi_object}
+
+
+def lighting(geometry):
+    """
+    :return: Diffuse, shadow and ambient occlusion images for the geometry, each in the range 0 to 1.
+    """
+    diffuse = np.clip(geometry.norm_x * LIGHT_DIRECTION[0] +
+                      geometry.norm_y * LIGHT_DIRECTION[1] +
+                      geometry.norm_z * LIGHT_DIRECTION[2], 0, 1) * geometry.obj
+    # Attached shadow only: fully lit where facing the light, with a soft terminator.
+    shadow = np.clip(diffuse * 4, 0, 1) * geometry.obj
+    # Occlusion increases as the surface turns away from the viewer.
+    ao = (0.5 + 0.5 * geometry.norm_z) * geometry.obj
+    return diffuse, shadow, ao
+
+
+def write_passes(geometry, out_path, frame=1):
+    """
+    Encode the geometry as render pass images, using the file names and formats written by the compositor: 8-bit
+    grayscale images for scalar passes and gamma-encoded 16-bit TIFFs for normals and UVs.
+
+    :param geometry: Geometry of the scene.
+    :param out_path: Directory in which to write the passes.
+    :param frame: Frame number of the passes.
+    """
+    os.makedirs(out_path, exist_ok=True)
+    diffuse, shadow, ao = lighting(geometry)
+
+    def write_8bit(name, image):
+        image = np.round(np.clip(image, 0, 1) * 255).astype(np.uint8)
+        imageio.imwrite(os.path.join(out_path, PASS_FILENAMES[name].format(frame)), np.dstack([image] * 3))
+
+    def write_16bit(name, channels):
+        image = np.clip(np.dstack(channels), 0, 1) ** (1 / 2.2)
+        imageio.imwrite(os.path.join(out_path, PASS_FILENAMES[name].format(frame)),
+                        np.round(image * 65535).astype(np.uint16))
+
+    write_8bit("obj", geometry.obj)
+    write_8bit("z", geometry.z)
+    write_8bit("diffdir", diffuse)
+    write_8bit("shadow", shadow)
+    write_8bit("ao", ao)
+    # Normals are mapped from -1..1 into 0..1, and masked to the object as the compositor does.
+    write_16bit("norm", [(geometry.norm_x + 1) / 2 * geometry.obj,
+                         (geometry.norm_y + 1) / 2 * geometry.obj,
+                         geometry.norm_z])
+    write_16bit("uv", [geometry.u, geometry.v, np.zeros_like(geometry.u)])
@@ -0,0 +1,111 @@
+"""
+Command-line interface for illustrating render passes without Blender.
+
+Example:
+    python -m blender_hand_drawn_npr /renders/shot_01 -o /illustrations/shot_01.svg -s settings.json
+
+The settings file is a JSON object mapping Settings field names to values. Nested parameters (e.g.
+silhouette_thickness_parameters) are given as objects. Any values not given take their defaults.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from blender_hand_drawn_npr.model.batch import discover_frames, frame_filepath, illustrate_jobs
+from blender_hand_drawn_npr.model.data import settings_from_dict
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m blender_hand_drawn_npr",
+                                     description="Produce hand-drawn style SVG illustrations from render passes.")
+    parser.add_argument("in_paths", nargs="+", metavar="IN_PATH",
+                        help="Directory containing render pass images")
+    parser.add_argument("-o", "--out", required=True,
+                        help="Output SVG file path, or output directory if several IN_PATHs are given. As in "
+                             "Blender, a run of '#' is replaced by the frame number")
+    parser.add_argument("-s", "--settings",
+                        help="JSON settings file")
+    parser.add_argument("-f", "--frames", nargs=2, type=int, metavar=("FIRST", "LAST"),
+                        help="Inclusive range of frames to illustrate. By default all frames found are illustrated")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of frames to illustrate in parallel (default: 1)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log progress to the console")
+    return parser.parse_args(argv)
+
+
+def build_jobs(args, settings):
+    """
+    :return: List of (settings, frame) tuples, one for each frame of each input directory.
+    """
+    jobs = []
+    for in_path in args.in_paths:
+        if len(args.in_paths) == 1:
+            out_filepath = args.out
+        else:
+            out_filepath = os.path.join(args.out, os.path.basename(os.path.normpath(in_path)) + ".svg")
+
+        if args.frames:
+            frames = list(range(args.frames[0], args.frames[1] + 1))
+        else:
+            frames = discover_frames(in_path)
+            if not frames:
+                logger.warning("No render passes found in: %s", in_path)
+
+        for frame in frames:
+            # A single frame is written to the output path as given, unless it contains a frame placeholder.
+            if len(frames) > 1 or "#" in out_filepath:
+                frame_out_filepath = frame_filepath(out_filepath, frame)
+            else:
+                frame_out_filepath = out_filepath
+            jobs.append((settings._replace(in_path=in_path, out_filepath=frame_out_filepath), frame))
+
+    return jobs
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.verbose:
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        console.setLevel(logging.INFO)
+        logging.getLogger().addHandler(console)
+
+    values = {}
+    if args.settings:
+        with open(args.settings) as settings_file:
+            values = json.load(settings_file)
+    try:
+        settings = settings_from_dict(values)
+    except ValueError as e:
+        print("Invalid settings file: " + str(e), file=sys.stderr)
+        return 1
+
+    if len(args.in_paths) > 1:
+        os.makedirs(args.out, exist_ok=True)
+
+    jobs = build_jobs(args, settings)
+    if not jobs:
+        print("No frames to illustrate.", file=sys.stderr)
+        return 1
+
+    try:
+        summary = illustrate_jobs(jobs, processes=args.jobs)
+    except FileNotFoundError as e:
+        print("Render pass not found: " + str(e.filename), file=sys.stderr)
+        return 1
+
+    print("{} illustration(s) written in {:.1f} s ({:.1f} frames per minute).".format(len(summary.out_filepaths),
+                                                                                   summary.elapsed,
+                                                                                   summary.frames_per_minute))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import namedtuple
+
+from blender_hand_drawn_npr.model.illustrate import Illustrator, PASS_FILENAMES
+
+logger = logging.getLogger(__name__)
+
+BatchSummary = namedtuple("BatchSummary", ["out_filepaths",
+                                           "elapsed",
+                                           "frames_per_minute"])
+
+
+def discover_frames(in_path):
+    """
+    :param in_path: Directory containing render pass images.
+    :return: Sorted frame numbers for which an object index pass exists in in_path.
+    """
+    prefix, suffix = PASS_FILENAMES["obj"].split("{:04d}")
+    pattern = re.compile("^" + re.escape(prefix) + r"(\d+)" + re.escape(suffix) + "$")
+
+    frames = []
+    for file_name in os.listdir(in_path):
+        match = pattern.match(file_name)
+        if match:
+            frames.append(int(match.group(1)))
+
+    return sorted(frames)
+
+
+def frame_filepath(filepath, frame):
+    """
+    :param filepath: Output file path. As in Blender, a run of "#" characters is replaced by the zero-padded frame
+                     number. Without any "#", the frame number is appended to the file name.
+    :param frame: Frame number.
+    :return: Output file path for the given frame.
+    """
+    if "#" in filepath:
+        return re.sub("#+", lambda match: "{:0{}d}".format(frame, len(match.group(0))), filepath)
+
+    root, ext = os.path.splitext(filepath)
+    return "{}_{:04d}{}".format(root, frame, ext)
+
+
+def illustrate_frame(job):
+    """
+    Illustrate a single frame. Intended to be run in a worker process.
+
+    :param job: Tuple of (settings, frame).
+    :return: File path of the saved illustration.
+    """
+    settings, frame = job
+
+    start = time.perf_counter()
+    illustrator = Illustrator(settings, frame)
+    illustrator.illustrate()
+    illustrator.save()
+    logger.info("Frame %d illustrated in %.2f s", frame, time.perf_counter() - start)
+
+    return settings.out_filepath
+
+
+def illustrate_jobs(jobs, processes=None):
+    """
+    Illustrate many frames in parallel across a process pool. Each worker process is replaced after completing a
+    single frame, so the memory held by any one worker is bounded by that of a single frame. A single job, or a single
+    process, is run in this process instead, leaving it free to start worker processes of its own (e.g. for
+    streamlines).
+
+    :param jobs: Iterable of (settings, frame) tuples. Each job should write to a distinct settings.out_filepath.
+    :param processes: Number of worker processes. If None, one per CPU.
+    :return: BatchSummary.
+    """
+    jobs = list(jobs)
+
+    start = time.perf_counter()
+    if processes == 1 or len(jobs) <= 1:
+        out_filepaths = [illustrate_frame(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(processes=processes, maxtasksperchild=1) as pool:
+            # Results are returned in job order, regardless of completion order.
+            out_filepaths = pool.map(illustrate_frame, jobs, chunksize=1)
+    elapsed = time.perf_counter() - start
+
+    frames_per_minute = len(jobs) / elapsed * 60 if elapsed else 0
+    logger.info("Batch of %d frames illustrated in %.2f s (%.1f frames per minute)",
+                len(jobs), elapsed, frames_per_minute)
+
+    return BatchSummary(out_filepaths=out_filepaths, elapsed=elapsed, frames_per_minute=frames_per_minute)
+
+
+def illustrate_frames(settings, frames=None, processes=None):
+    """
+    Illustrate a range of animation frames, writing one SVG per frame.
+
+    :param settings: Settings. The frame number is inserted into out_filepath per frame_filepath.
+    :param frames: Iterable of frame numbers. If None, all frames found in settings.in_path are illustrated.
+    :param processes: Number of worker processes. If None, one per CPU.
+    :return: BatchSummary.
+    """
+    if frames is None:
+        frames = discover_frames(settings.in_path)
+        logger.info("Frames found: %d", len(frames))
+
+    jobs = [(settings._replace(out_filepath=frame_filepath(settings.out_filepath, frame)), frame) for frame in frames]
+
+    return illustrate_jobs(jobs, processes)
@@ -1,14 +1,20 @@
 import logging
+import os
+import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import imageio
-from skimage import io, exposure
+import numpy as np
+from scipy import ndimage
+from skimage import io, exposure, color
 
 logger = logging.getLogger(__name__)
 
 Settings = namedtuple("Settings", ["cull_factor",
                                    "optimise_factor",
                                    "curve_fit_error",
+                                   "curve_fitter",
                                    "harris_min_distance",
                                    "subpix_window_size",
                                    "curve_sampling_interval",
@@ -25,6 +31,12 @@ Settings = namedtuple("Settings", ["cull_factor",
                                    "enable_internal_edges",
                                    "enable_streamlines",
                                    "enable_stipples",
+                                   "load_workers",
+                                   "streamline_workers",
+                                   "cache_passes",
+                                   "compact_surface",
+                                   "roi_padding",
+                                   "write_report",
                                    "in_path",
                                    "out_filepath"])
 
@@ -46,11 +58,219 @@ StippleParameters = namedtuple("StippleParameters", ["head_radius",
                                                      "density_fn_exponent"])
 
 
+# Default values of all Settings other than in_path and out_filepath. These match the defaults of the Blender UI.
+DEFAULT_SETTINGS = {"cull_factor": 20,
+                    "optimise_factor": 5,
+                    "curve_fit_error": 0.01,
+                    "curve_fitter": "numpy",
+                    "harris_min_distance": 40,
+                    "subpix_window_size": 20,
+                    "curve_sampling_interval": 20,
+                    "stroke_colour": "black",
+                    "streamline_segments": 16,
+                    "silhouette_thickness_parameters": {"const": 1, "z": 0, "diffdir": 0, "stroke_curvature": 0},
+                    "internal_edge_thickness_parameters": {"const": 1, "z": 0, "diffdir": 0, "stroke_curvature": 0},
+                    "streamline_thickness_parameters": {"const": 1, "z": 0, "diffdir": 0, "stroke_curvature": 0},
+                    "uv_primary_trim_size": 200,
+                    "uv_secondary_trim_size": 20,
+                    "lighting_parameters": {"diffdir": 1, "shadow": 1, "ao": 1, "threshold": 0},
+                    "stipple_parameters": {"head_radius": 1, "tail_radius": 0, "length": 30,
+                                           "density_fn_min": 0.004, "density_fn_factor": 0.002,
+                                           "density_fn_exponent": 1},
+                    "optimise_clip_paths": False,
+                    "enable_internal_edges": False,
+                    "enable_streamlines": False,
+                    "enable_stipples": False,
+                    "load_workers": None,
+                    "streamline_workers": 1,
+                    "cache_passes": False,
+                    "compact_surface": False,
+                    "roi_padding": 32,
+                    "write_report": True}
+
+# Settings fields which are held in nested namedtuples.
+NESTED_SETTINGS = {"silhouette_thickness_parameters": ThicknessParameters,
+                   "internal_edge_thickness_parameters": ThicknessParameters,
+                   "streamline_thickness_parameters": ThicknessParameters,
+                   "lighting_parameters": LightingParameters,
+                   "stipple_parameters": StippleParameters}
+
+
+def settings_from_dict(values):
+    """
+    :param values: Dict of Settings values, e.g. as read from a JSON settings file. Nested parameters are given as
+                   dicts. Any values not given, including individual nested parameters, take their default from
+                   DEFAULT_SETTINGS. in_path and out_filepath default to None.
+    :return: Settings.
+    """
+    if not isinstance(values, dict):
+        raise ValueError("Settings must be an object")
+    unknown = set(values) - set(Settings._fields)
+    if unknown:
+        raise ValueError("Unknown settings: " + ", ".join(sorted(unknown)))
+
+    merged = dict(DEFAULT_SETTINGS, in_path=None, out_filepath=None)
+    for name, value in values.items():
+        if name in NESTED_SETTINGS:
+            if not isinstance(value, dict):
+                raise ValueError(name + " must be an object")
+            nested_type = NESTED_SETTINGS[name]
+            unknown = set(value) - set(nested_type._fields)
+            if unknown:
+                raise ValueError("Unknown " + name + ": " + ", ".join(sorted(unknown)))
+            value = dict(merged[name], **value)
+        merged[name] = value
+
+    for name, nested_type in NESTED_SETTINGS.items():
+        merged[name] = nested_type(**merged[name])
+
+    return Settings(**merged)
+
+
+# Decoded render passes are cached in this directory, alongside the original images.
+CACHE_DIRNAME = ".npr_cache"
+# Format of the cache entries, included in their names so that entries of an earlier format are never loaded. Version 2
+# entries hold images in the dtype of the image file, rather than converted to float.
+CACHE_VERSION = 2
+
+# Names of the per-pixel Surface attributes, each held by a <name>_image attribute. Compact storage stacks the
+# attributes in this order, which keeps the three normal channels adjacent.
+CHANNELS = ("obj", "z", "diffdir", "norm_x", "norm_y", "norm_z", "u", "v", "shadow", "ao")
+
+# Render passes, and the channels that are decoded from each.
+PASS_CHANNELS = {"obj": ("obj",),
+                 "z": ("z",),
+                 "diffdir": ("diffdir",),
+                 "norm": ("norm_x", "norm_y", "norm_z"),
+                 "uv": ("u", "v"),
+                 "shadow": ("shadow",),
+                 "ao": ("ao",)}
+
+
+# Passes are read in two steps: decoding the file to an array of its native dtype, which is what the pass cache holds,
+# and converting that array to the values held by the Surface.
+
+def to_gray(image):
+    # As io.imread(file_path, as_gray=True).
+    if image.ndim > 2:
+        if image.shape[2] == 4:
+            image = color.rgba2rgb(image)
+        image = color.rgb2gray(image)
+    return image
+
+
+def to_gamma_corrected(image):
+    # Original image will be mapped to non-linear colourspace. Correct the encoded values by adjusting this.
+    return exposure.adjust_gamma(image, 2.2)
+
+
+# 16-bit colour-depth passes are decoded with imageio.
+GRAY = (io.imread, to_gray)
+GAMMA_CORRECTED = (imageio.imread, to_gamma_corrected)
+
+
+def read_gray(file_path):
+    return to_gray(io.imread(file_path))
+
+
+def read_gamma_corrected(file_path):
+    return to_gamma_corrected(imageio.imread(file_path))
+
+
+def is_memory_mapped(image):
+    """
+    :return: True if the image is, or is a view of, a memory-mapped array.
+    """
+    while isinstance(image, np.ndarray):
+        if isinstance(image, np.memmap):
+            return True
+        image = image.base
+    return False
+
+
+def load_cached(file_path, decode):
+    """
+    Load an image via a cache of decoded arrays. The result of decode(file_path) is saved as a .npy file in a cache
+    directory next to the image, keyed by the image file name, modification time and size. Later calls for an
+    unchanged image memory-map the cached array rather than decoding the image again.
+
+    :param file_path: Path to the image.
+    :param decode: Function which decodes the image at file_path into an array. This should keep the dtype of the
+                   image file, as converting e.g. 8-bit images to float would multiply the size of the cache.
+    :return: The decoded array.
+    """
+    stat = os.stat(file_path)
+    cache_dir = os.path.join(os.path.dirname(file_path), CACHE_DIRNAME)
+    cache_prefix = os.path.basename(file_path) + "."
+    cache_path = os.path.join(cache_dir, "{}{}-{}.{}.npy".format(cache_prefix, stat.st_mtime_ns, stat.st_size,
+                                                                CACHE_VERSION))
+
+    if os.path.exists(cache_path):
+        try:
+            # Copy-on-write mapping: pages are read on demand, and consumers requiring a writable buffer still work.
+            image = np.load(cache_path, mmap_mode="c")
+            logger.debug("Cache hit: %s", cache_path)
+            return image
+        except (OSError, ValueError):
+            logger.warning("Cache entry could not be read: %s", cache_path)
+
+    image = decode(file_path)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Entries for previous versions of this image are stale.
+        for file_name in os.listdir(cache_dir):
+            if file_name.startswith(cache_prefix):
+                os.remove(os.path.join(cache_dir, file_name))
+
+        # Write to a temporary file first, so that a partially written entry can never be loaded.
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as tmp_file:
+            np.save(tmp_file, image)
+        os.replace(tmp_path, cache_path)
+        logger.debug("Cache entry written: %s", cache_path)
+    except OSError:
+        logger.warning("Cache entry could not be written: %s", cache_path)
+
+    return image
+
+
+def channel_property(name):
+    """
+    :param name: Channel name, as listed in CHANNELS.
+    :return: Property exposing the image of the named Surface channel.
+    """
+    return property(lambda self: self.get_image(name),
+                    lambda self, image: self.set_image(name, image))
+
+
 class Surface:
+    """
+    A Surface holds the per-pixel attributes of the render subject, as decoded from the render passes. Passes
+    registered with add_pass_files are loaded on first access of their attributes.
+    """
+
+    obj_image = channel_property("obj")
+    z_image = channel_property("z")
+    diffdir_image = channel_property("diffdir")
+    norm_x_image = channel_property("norm_x")
+    norm_y_image = channel_property("norm_y")
+    norm_z_image = channel_property("norm_z")
+    u_image = channel_property("u")
+    v_image = channel_property("v")
+    shadow_image = channel_property("shadow")
+    ao_image = channel_property("ao")
 
     def __init__(self, obj_image=None, z_image=None, diffdir_image=None,
                  norm_x_image=None, norm_y_image=None, norm_z_image=None,
-                 u_image=None, v_image=None, shadow_image=None, ao_image=None):
+                 u_image=None, v_image=None, shadow_image=None, ao_image=None, use_cache=False):
+        self.__images = {}
+        # Files of passes which are yet to be loaded.
+        self.__pass_files = {}
+        # Region of the full frame to which all images are cropped, as (min_row, min_col, max_row, max_col).
+        self.region = None
+
         self.obj_image = obj_image
         self.z_image = z_image
         self.diffdir_image = diffdir_image
@@ -63,25 +283,129 @@ class Surface:
         self.shadow_image = shadow_image
         self.ao_image = ao_image
 
+        # If enabled, decoded images are cached on disk and re-used while the source images are unchanged.
+        self.use_cache = use_cache
+
+        # Contiguous (H, W, C) array holding all attributes once compact() has been called.
+        self.channels = None
+
+        # Maps derived from the images, computed on first use and discarded whenever the images change.
+        self.__derived = {}
+
         self.SurfaceData = namedtuple("SurfaceData", "obj z diffdir norm_x norm_y norm_z u v")
 
+    def get_image(self, name):
+        """
+        :param name: Channel name, as listed in CHANNELS.
+        :return: Image of the named channel. If the channel's pass has been registered but not yet loaded, it is
+                 loaded first.
+        """
+        image = self.__images.get(name)
+
+        if image is None:
+            pass_name = next(pass_name for pass_name, channels in PASS_CHANNELS.items() if name in channels)
+            file_path = self.__pass_files.pop(pass_name, None)
+            if file_path is not None:
+                logger.info("Loading pass '%s' on demand.", pass_name)
+                getattr(self, "init_" + pass_name + "_image")(file_path)
+                image = self.__images.get(name)
+
+        return image
+
+    def set_image(self, name, image):
+        self.__images[name] = image
+        self.__invalidate_derived()
+
+    def __invalidate_derived(self):
+        # Derived maps are only valid for the images from which they were computed.
+        self.__derived = {}
+
+    @property
+    def loaded_channels(self):
+        """
+        :return: Names of the channels currently held in memory, in CHANNELS order.
+        """
+        return tuple(name for name in CHANNELS if self.__images.get(name) is not None)
+
+    def add_pass_files(self, file_paths):
+        """
+        Register render pass images, to be loaded only when one of their attributes is first accessed.
+
+        :param file_paths: Dict mapping a pass name, as listed in PASS_CHANNELS, to the image file for that pass.
+        """
+        self.__pass_files.update(file_paths)
+
+    def __read(self, file_path, reader):
+        """
+        :param reader: Tuple of the function which decodes the image file, and the function which converts the decoded
+                       image to the values of the Surface, e.g. GRAY.
+        """
+        decode, convert = reader
+        if self.use_cache:
+            image = load_cached(file_path, decode)
+        else:
+            image = decode(file_path)
+
+        if self.region is not None:
+            min_row, min_col, max_row, max_col = self.region
+            image = image[min_row:max_row, min_col:max_col]
+
+        return convert(image)
+
+    def object_region(self, padding):
+        """
+        :param padding: Number of pixels by which to pad the bounding box on each side.
+        :return: Padded bounding box of the render subject in obj_image, as (min_row, min_col, max_row, max_col),
+                 clipped to the image. None if the subject is not present.
+        """
+        obj_mask = self.obj_image != 0
+        rows = np.flatnonzero(obj_mask.any(axis=1))
+        cols = np.flatnonzero(obj_mask.any(axis=0))
+
+        if not len(rows):
+            return None
+
+        height, width = obj_mask.shape
+        return (int(max(rows[0] - padding, 0)),
+                int(max(cols[0] - padding, 0)),
+                int(min(rows[-1] + 1 + padding, height)),
+                int(min(cols[-1] + 1 + padding, width)))
+
+    def crop(self, region):
+        """
+        Restrict the Surface to a region of the full frame. Loaded images are replaced by views of the region, and
+        images loaded later are cropped as they are read. Image-space coordinates of the Surface are then relative to
+        the top left of the region.
+
+        :param region: Region as (min_row, min_col, max_row, max_col).
+        """
+        assert self.region is None, "Surface has already been cropped."
+        min_row, min_col, max_row, max_col = region
+
+        for name in self.loaded_channels:
+            self.__images[name] = self.__images[name][min_row:max_row, min_col:max_col]
+        if self.norm_image is not None:
+            self.norm_image = self.norm_image[min_row:max_row, min_col:max_col]
+
+        self.region = tuple(region)
+        self.__invalidate_derived()
+        logger.info("Surface cropped to region: %s", self.region)
+
     def init_obj_image(self, file_path):
-        self.obj_image = io.imread(file_path, as_gray=True)
+        self.obj_image = self.__read(file_path, GRAY)
         logger.info("Object image loaded: %s", file_path)
 
     def init_z_image(self, file_path):
-        self.z_image = io.imread(file_path, as_gray=True)
+        self.z_image = self.__read(file_path, GRAY)
         logger.info("Z image loaded: %s", file_path)
 
     def init_diffdir_image(self, file_path):
-        self.diffdir_image = io.imread(file_path, as_gray=True)
+        self.diffdir_image = self.__read(file_path, GRAY)
         logger.info("Diffdir image loaded: %s", file_path)
 
     def init_norm_image(self, file_path):
-        norm_image = imageio.imread(file_path)
+        norm_image = self.__read(file_path, GAMMA_CORRECTED)
         logger.info("Normal image loaded: %s", file_path)
-        # Original image will be mapped to non-linear colourspace. Correct the normals by adjusting this.
-        norm_image = exposure.adjust_gamma(norm_image, 2.2)
         self.norm_image = norm_image
 
         # Normal x values are encoded in red channel.
@@ -92,10 +416,7 @@ class Surface:
         self.norm_z_image = norm_image[:, :, 2]
 
     def init_uv_image(self, file_path):
-        # 16-bit colour-depth, use imageio.
-        uv_image = imageio.imread(file_path)
-        # Original image will be mapped to non-linear colourspace. Correct the uv coordinates by adjusting this.
-        uv_image = exposure.adjust_gamma(uv_image, 2.2)
+        uv_image = self.__read(file_path, GAMMA_CORRECTED)
 
         # u coordinates are encoded in red channel.
         self.u_image = uv_image[:, :, 0]
@@ -105,13 +426,94 @@ class Surface:
         logger.info("UV image loaded: %s", file_path)
 
     def init_shadow_image(self, file_path):
-        self.shadow_image = io.imread(file_path, as_gray=True)
+        self.shadow_image = self.__read(file_path, GRAY)
         logger.info("Shadow image loaded: %s", file_path)
 
     def init_ao_image(self, file_path):
-        self.ao_image = io.imread(file_path, as_gray=True)
+        self.ao_image = self.__read(file_path, GRAY)
         logger.info("AO image loaded: %s", file_path)
 
+    def init_images(self, file_paths, max_workers=None):
+        """
+        Decode and post-process several render pass images concurrently. Decoding is dominated by compiled library
+        code which releases the GIL, so a thread pool is sufficient and avoids copying images between processes.
+
+        :param file_paths: Dict mapping a pass name (e.g. "obj", "norm", "uv") to the image file for that pass. Each
+                           pass is loaded by the corresponding init_<name>_image method.
+        :param max_workers: Maximum number of concurrent loaders. If None, one loader is used per pass.
+        """
+
+        def load(name, file_path):
+            start = time.perf_counter()
+            getattr(self, "init_" + name + "_image")(file_path)
+            logger.info("Pass '%s' loaded in %.3f s", name, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers or max(len(file_paths), 1)) as executor:
+            futures = [executor.submit(load, name, file_path) for name, file_path in file_paths.items()]
+            # Propagate any loading errors (e.g. FileNotFoundError) to the caller.
+            for future in futures:
+                future.result()
+
+        logger.info("%d passes loaded in %.3f s", len(file_paths), time.perf_counter() - start)
+
+    @property
+    def nbytes(self):
+        """
+        :return: Total size in bytes of the arrays holding the per-pixel attributes. Memory shared between views is
+                 counted once.
+        """
+        buffers = {}
+        for image in [self.__images[name] for name in self.loaded_channels] + [self.norm_image]:
+            if image is None:
+                continue
+            while isinstance(image.base, np.ndarray):
+                image = image.base
+            buffers[id(image)] = image.nbytes
+
+        return sum(buffers.values())
+
+    def compact(self):
+        """
+        Re-pack all loaded attributes into a single contiguous (H, W, C) array of the narrowest dtype which represents
+        every channel exactly: uint8/uint16 if all channels are such unsigned integers, otherwise float32 (which holds
+        any uint16 value exactly). Existing attribute names remain usable, as views into this array.
+
+        Only the channels loaded so far are packed. Channels loaded later, e.g. on demand from passes registered with
+        add_pass_files, are held in arrays of their own.
+
+        Compaction is skipped if any channel is memory-mapped from the pass cache, as copying would read every page of
+        the mapping into memory, and the mapping is already cheaper than any in-memory copy.
+        """
+        names = self.loaded_channels
+        images = [self.__images[name] for name in names]
+
+        if not images:
+            logger.debug("No channels loaded, compaction skipped.")
+            return
+        if any(is_memory_mapped(image) for image in images):
+            logger.info("Surface channels are memory-mapped, compaction skipped.")
+            return
+
+        dtype = np.result_type(*images)
+        if not (dtype.kind == "u" and dtype.itemsize <= 2):
+            dtype = np.float32
+
+        self.channels = np.empty(images[0].shape + (len(names),), dtype=dtype)
+        for i, (name, image) in enumerate(zip(names, images)):
+            self.channels[:, :, i] = image
+            setattr(self, name + "_image", self.channels[:, :, i])
+
+        # The combined normal image is only kept as a view of its (adjacent) channels.
+        if self.norm_image is not None:
+            if "norm_x" in names:
+                norm_start = names.index("norm_x")
+                self.norm_image = self.channels[:, :, norm_start:norm_start + 3]
+            else:
+                self.norm_image = None
+
+        logger.info("Surface compacted to %s array of %s.", self.channels.shape, self.channels.dtype)
+
     def at_point(self, x, y):
         assert x >= 0
         assert y >= 0
@@ -131,10 +533,119 @@ class Surface:
                                         v=self.v_image[y, x])
         return surface_data
 
+    def at_points(self, xs, ys, channels=None):
+        """
+        Vectorised equivalent of at_point, sampling surface attributes at many points in a single operation.
+
+        :param xs: Array of x coordinates.
+        :param ys: Array of y coordinates.
+        :param channels: Names of the SurfaceData fields to sample. If None, all fields are sampled.
+        :return: SurfaceData where each sampled field is an array holding the attribute value at each of the given
+                 points. Fields which were not sampled are None.
+        """
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        assert np.all(xs >= 0)
+        assert np.all(ys >= 0)
+
+        xs = xs.astype(int)
+        ys = ys.astype(int)
+        assert np.all(xs < self.obj_image.shape[1])
+        assert np.all(ys < self.obj_image.shape[0])
+
+        if channels is None:
+            channels = self.SurfaceData._fields
+
+        surface_data = self.SurfaceData(**{name: self.get_image(name)[ys, xs] if name in channels else None
+                                           for name in self.SurfaceData._fields})
+        return surface_data
+
     def is_valid(self, point):
-        surface_data = self.at_point(point[0], point[1])
+        surface_data = self.at_points(point[0], point[1], channels=("obj",))
         return surface_data.obj != 0
 
+    @property
+    def nearest_valid_indices(self):
+        """
+        Map from every pixel to a nearby pixel on the render subject, computed on first use. Pixels on the subject map
+        to themselves. Pixels off the subject map to the first neighbour on the subject in the order N, S, E, W, NE,
+        SE, SW, NW, or failing that to the nearest pixel on the subject in Euclidean distance.
+
+        :return: (2, H, W) array holding the row and column index of the pixel to which each pixel maps.
+        """
+        return self.derived("nearest_valid_indices", self.__compute_nearest_valid_indices)
+
+    def __compute_nearest_valid_indices(self):
+        valid = self.obj_image != 0
+        height, width = valid.shape
+        indices = np.empty((2, height, width), dtype=np.int32)
+
+        if valid.any():
+            ndimage.distance_transform_edt(~valid, return_distances=False, return_indices=True, indices=indices)
+
+            # Neighbour translations as (x, y), applied in reverse order of preference so that the most preferred
+            # valid neighbour is written last.
+            rows, cols = np.indices((height, width), dtype=np.int32)
+            for dx, dy in reversed(((0, -1), (0, 1), (1, 0), (-1, 0), (1, -1), (1, 1), (-1, 1), (-1, -1))):
+                # Valid neighbours, aligned with the pixel they neighbour.
+                neighbour_valid = np.zeros_like(valid)
+                neighbour_valid[max(-dy, 0):height - max(dy, 0), max(-dx, 0):width - max(dx, 0)] = \
+                    valid[max(dy, 0):height - max(-dy, 0), max(dx, 0):width - max(-dx, 0)]
+                selected = neighbour_valid & ~valid
+                indices[0][selected] = rows[selected] + dy
+                indices[1][selected] = cols[selected] + dx
+        else:
+            logger.warning("No valid surface pixels, points can not be moved onto the surface.")
+            indices[:] = np.indices((height, width))
+
+        return indices
+
+    def channel_range(self, name):
+        """
+        :param name: Channel name, as listed in CHANNELS.
+        :return: Tuple of the minimum and maximum values of the named channel's image, computed on first use.
+        """
+        return self.derived(name + "_range", lambda: (self.get_image(name).min(), self.get_image(name).max()))
+
+    def derived(self, key, compute):
+        """
+        :param key: Hashable key identifying the map, including any parameters on which it depends.
+        :param compute: Function of no arguments which computes the map from the images.
+        :return: The map, computed on first use and discarded whenever the images change.
+        """
+        value = self.__derived.get(key)
+        if value is None:
+            value = compute()
+            self.__derived[key] = value
+
+        return value
+
+    @property
+    def z_argmin_offsets(self):
+        """
+        Location of the minimum of z_image within the 3x3 window centred on every pixel, computed on first use. Where
+        the minimum occurs more than once, the first in row-major order is taken. Windows at the image border only
+        include pixels on the image.
+
+        :return: (H, W) array of codes 0 to 8 giving the row-major position of the minimum within each window, i.e.
+                 a row offset of code // 3 - 1 and a column offset of code % 3 - 1.
+        """
+        return self.derived("z_argmin_offsets", self.__compute_z_argmin_offsets)
+
+    def __compute_z_argmin_offsets(self):
+        height, width = self.z_image.shape
+        # Pad with infinity so that pixels beyond the border are never the minimum.
+        padded = np.pad(self.z_image.astype(float), 1, mode="constant", constant_values=np.inf)
+        minimum = ndimage.minimum_filter(padded, size=3)[1:-1, 1:-1]
+
+        # Assign codes in reverse order, so that the first position holding the minimum is written last.
+        offsets = np.zeros((height, width), dtype=np.uint8)
+        for code in reversed(range(9)):
+            row, col = divmod(code, 3)
+            offsets[padded[row:row + height, col:col + width] == minimum] = code
+
+        return offsets
+
     def compute_curvature(self, path, target_image):
         for i in range(0, len(path.points) - 1):
             cur_norm = self.at_point(path.points[i][0], path.points[i][1]).norm
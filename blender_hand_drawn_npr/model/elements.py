@@ -1,35 +1,38 @@
 import logging
 import math
+import multiprocessing
+import os
+from collections import Counter
 
 import numpy as np
-import svgpathtools as svgp
 import svgwrite
 from scipy import stats, ndimage
 from skimage import measure, util, feature, morphology, graph
 
-from blender_hand_drawn_npr.model.primitives import Path, Curve1D, CurvedStroke, DirectionalStippleStroke
-from blender_hand_drawn_npr.model.third_party.variable_density import moving_front_nodes
+from blender_hand_drawn_npr.model.primitives import Path, Curve1D, CurvedStroke, DirectionalStippleStroke, \
+    IsoContours, bezier_path_d
+from blender_hand_drawn_npr.model.node_placement import moving_front_nodes
 
 logger = logging.getLogger(__name__)
 
 
-def create_curved_stroke(construction_curve, hifi_path, thickness_parameters, surface, settings):
-    upper_path = construction_curve.offset(interval=settings.curve_sampling_interval,
-                                           hifi_path=hifi_path,
-                                           thickness_parameters=thickness_parameters,
-                                           surface=surface,
-                                           positive_direction=True)
+def create_curved_strokes(construction_curves, hifi_paths, thickness_parameters, surface, settings):
+    """
+    Create a CurvedStroke around each construction curve. The offset curves of all strokes are fitted together.
 
-    upper_curve = Curve1D(fit_path=upper_path, settings=settings)
+    :return: List of CurvedStrokes, one for each construction curve.
+    """
+    offset_paths = []
+    for construction_curve, hifi_path in zip(construction_curves, hifi_paths):
+        offset_paths += construction_curve.offset_both(interval=settings.curve_sampling_interval,
+                                                       hifi_path=hifi_path,
+                                                       thickness_parameters=thickness_parameters,
+                                                       surface=surface)
 
-    lower_path = construction_curve.offset(interval=settings.curve_sampling_interval,
-                                           hifi_path=hifi_path,
-                                           thickness_parameters=thickness_parameters,
-                                           surface=surface,
-                                           positive_direction=False)
-    lower_curve = Curve1D(fit_path=lower_path, settings=settings)
+    offset_curves = Curve1D.fit_all(offset_paths, settings)
 
-    return CurvedStroke(upper_curve=upper_curve, lower_curve=lower_curve)
+    return [CurvedStroke(upper_curve=upper_curve, lower_curve=lower_curve)
+            for upper_curve, lower_curve in zip(offset_curves[0::2], offset_curves[1::2])]
 
 
 class Silhouette:
@@ -37,6 +40,9 @@ class Silhouette:
     A Silhouette is a collection of Strokes which capture the silhouette of the render subject.
     """
 
+    # Render passes read by this element.
+    passes = ("obj", "z", "diffdir")
+
     def __init__(self, surface, settings):
         self.surface = surface
         self.settings = settings
@@ -44,12 +50,15 @@ class Silhouette:
         self.boundary_curves = []
         self.clip_path_d = None
         self.svg_strokes = []
+        self.counts = Counter()
 
     def __generate_clip_path(self):
 
         # Combine curves into a single path.
-        combined = svgp.path.concatpaths([svgp.parse_path(curve) for curve in self.boundary_curves])
-        self.clip_path_d = combined.d()
+        if self.boundary_curves:
+            self.clip_path_d = bezier_path_d(np.concatenate([curve.control_points for curve in self.boundary_curves]))
+        else:
+            self.clip_path_d = ""
 
     def generate(self):
         """
@@ -62,14 +71,16 @@ class Silhouette:
         # find_contours may return more than one contour set. Assume the "correct" contour is the longest path in
         # the set.
         contour = max(contours, key=len)
+        self.counts["contours"] += len(contours)
 
         # Create the initial Path.
-        path = Path([[coord[1], coord[0]] for coord in contour])
+        path = Path(contour, is_rc=True)
 
         # Initial Path must be split into multiple Paths if corners are present.
         corners = path.find_corners(self.surface.obj_image, self.settings.harris_min_distance,
                                     self.settings.subpix_window_size)
         logger.info("Silhouette corners found: %d", len(corners))
+        self.counts["corners"] += len(corners)
 
         if corners:
             self.paths += path.split_corners(corners)
@@ -77,34 +88,46 @@ class Silhouette:
             self.paths.append(path)
 
         logger.info("Silhouette Paths found: %d", len(self.paths))
+        self.counts["paths"] += len(self.paths)
 
+        hifi_paths = []
+        fit_paths = []
         for path in self.paths:
             hifi_path = path.round().bump(self.surface).remove_dupes().simple_cull(self.settings.cull_factor)
             fit_path = hifi_path.optimise(self.settings.optimise_factor)
 
-            if len(fit_path.points) < 2:
-                logger.debug("Silhouette path of length %d ignored.", len(path.points))
+            if len(fit_path) < 2:
+                logger.debug("Silhouette path of length %d ignored.", len(path))
                 continue
 
-            logger.debug("Creating Silhouette stroke...")
-            construction_curve = Curve1D(fit_path=fit_path, settings=self.settings)
-            self.boundary_curves.append(construction_curve.d)
-            stroke = create_curved_stroke(construction_curve=construction_curve,
-                                          hifi_path=hifi_path,
-                                          thickness_parameters=self.settings.silhouette_thickness_parameters,
-                                          surface=self.surface,
-                                          settings=self.settings)
+            hifi_paths.append(hifi_path)
+            fit_paths.append(fit_path)
+
+        logger.debug("Creating Silhouette strokes...")
+        self.boundary_curves = Curve1D.fit_all(fit_paths, self.settings)
+        strokes = create_curved_strokes(construction_curves=self.boundary_curves,
+                                        hifi_paths=hifi_paths,
+                                        thickness_parameters=self.settings.silhouette_thickness_parameters,
+                                        surface=self.surface,
+                                        settings=self.settings)
+
+        for construction_curve, stroke in zip(self.boundary_curves, strokes):
+            self.counts["strokes"] += 1
+            self.counts["bezier_segments"] += construction_curve.segment_count + stroke.segment_count
             svg_stroke = svgwrite.path.Path(fill=self.settings.stroke_colour, stroke_width=0)
             svg_stroke.push(stroke.d)
             self.svg_strokes.append(svg_stroke)
 
-            logger.info("Silhouette Strokes prepared: %d", len(self.svg_strokes))
+        logger.info("Silhouette Strokes prepared: %d", len(self.svg_strokes))
 
         self.__generate_clip_path()
 
 
 class InternalEdges:
 
+    # Render passes read by this element.
+    passes = ("obj", "z", "diffdir")
+
     def __init__(self, surface, settings):
         self.settings = settings
         self.surface = surface
@@ -113,6 +136,7 @@ class InternalEdges:
         self.boundary_curves = []
 
         self.svg_strokes = []
+        self.counts = Counter()
 
     def __find_paths(self):
 
@@ -163,23 +187,32 @@ class InternalEdges:
 
     def generate(self):
         self.__find_paths()
+        self.counts["paths"] += len(self.paths)
 
+        hifi_paths = []
+        fit_paths = []
         for path in self.paths:
             hifi_path = path.round().bump_z(self.surface).remove_dupes().simple_cull(self.settings.cull_factor)
             fit_path = hifi_path.optimise(self.settings.optimise_factor)
 
-            if len(fit_path.points) < 2:
-                logger.debug("Internal Edge path of length %d ignored.", len(path.points))
+            if len(fit_path) < 2:
+                logger.debug("Internal Edge path of length %d ignored.", len(path))
                 continue
 
-            logger.debug("Creating Internal Edge stroke...")
-            construction_curve = Curve1D(fit_path=fit_path, settings=self.settings)
-            self.boundary_curves.append(construction_curve.d)
-            stroke = create_curved_stroke(construction_curve=construction_curve,
-                                          hifi_path=hifi_path,
-                                          thickness_parameters=self.settings.internal_edge_thickness_parameters,
-                                          surface=self.surface,
-                                          settings=self.settings)
+            hifi_paths.append(hifi_path)
+            fit_paths.append(fit_path)
+
+        logger.debug("Creating Internal Edge strokes...")
+        self.boundary_curves = Curve1D.fit_all(fit_paths, self.settings)
+        strokes = create_curved_strokes(construction_curves=self.boundary_curves,
+                                        hifi_paths=hifi_paths,
+                                        thickness_parameters=self.settings.internal_edge_thickness_parameters,
+                                        surface=self.surface,
+                                        settings=self.settings)
+
+        for construction_curve, stroke in zip(self.boundary_curves, strokes):
+            self.counts["strokes"] += 1
+            self.counts["bezier_segments"] += construction_curve.segment_count + stroke.segment_count
             svg_stroke = svgwrite.path.Path(fill=self.settings.stroke_colour, stroke_width=0)
             svg_stroke.push(stroke.d)
             self.svg_strokes.append(svg_stroke)
@@ -190,18 +223,23 @@ class Streamlines:
     Streamlines are a collection of SVG Streamline strokes.
     """
 
+    # Render passes read by this element.
+    passes = ("obj", "z", "diffdir", "uv")
+
     def __init__(self, surface, settings):
         self.settings = settings
         self.surface = surface
+        self.iso_contours = {}
         self.svg_strokes = []
+        self.counts = Counter()
 
     def generate(self):
         u_image = self.surface.u_image
         v_image = self.surface.v_image
         n = self.settings.streamline_segments
 
-        u_separation, v_separation = (u_image.max() - u_image.min()) / n, \
-                                     (v_image.max() - v_image.min()) / n
+        (u_min, u_max), (v_min, v_max) = self.surface.channel_range("u"), self.surface.channel_range("v")
+        u_separation, v_separation = (u_max - u_min) / n, (v_max - v_min) / n
         logger.debug("Streamline separation (u, v): %s, %s", u_separation, v_separation)
 
         u_intensities = []
@@ -214,100 +252,175 @@ class Streamlines:
             v_intensities.append(streamline_pos * v_separation)
         logger.debug("Intensities (v): %s", v_intensities)
 
-        strokes = []
-        for intensity in u_intensities:
-            norm_image_component = self.surface.norm_x_image
-            logger.debug("Creating (u) streamline at intensity %d...", intensity)
-            u_streamline = Streamline(primary_uv_image_component=u_image,
-                                      secondary_uv_image_component=v_image,
-                                      norm_image_component=norm_image_component,
-                                      surface=self.surface,
-                                      intensity=intensity,
-                                      settings=self.settings)
-            u_streamline.generate()
-            strokes += u_streamline.strokes
-
-        for intensity in v_intensities:
-            norm_image_component = self.surface.norm_y_image
-            logger.debug("Creating (v) streamline at intensity %d...", intensity)
-            v_streamline = Streamline(primary_uv_image_component=v_image,
-                                      secondary_uv_image_component=u_image,
-                                      norm_image_component=norm_image_component,
-                                      surface=self.surface,
-                                      intensity=intensity,
-                                      settings=self.settings)
-            v_streamline.generate()
-            strokes += v_streamline.strokes
-
-        for stroke in strokes:
-            svg_stroke = svgwrite.path.Path(fill=self.settings.stroke_colour, stroke_width=0)
-            svg_stroke.push(stroke.d)
-            self.svg_strokes.append(svg_stroke)
+        # Index each image once, so that only the region of the image bracketing an intensity is searched for its
+        # contours. Surfaces cropped to their region of interest gain little from this.
+        self.iso_contours = {"u": IsoContours(u_image), "v": IsoContours(v_image)}
+
+        jobs = [("u", intensity) for intensity in u_intensities] + [("v", intensity) for intensity in v_intensities]
+        results = self.__map(jobs)
+
+        for stroke_ds, counts in results:
+            self.counts.update(counts)
+            for d in stroke_ds:
+                svg_stroke = svgwrite.path.Path(fill=self.settings.stroke_colour, stroke_width=0)
+                svg_stroke.push(d)
+                self.svg_strokes.append(svg_stroke)
 
         logger.info("Streamline Strokes prepared: %d", len(self.svg_strokes))
 
+    def __map(self, jobs):
+        """
+        Generate the streamline of each job, in a pool of forked worker processes if more than one worker is requested.
+        Workers inherit the surface and contour indices from this process rather than receiving copies of them. This
+        relies on the fork start method: the Streamlines are handed to each worker through the pool initializer, whose
+        arguments are inherited by a forked worker but would have to be pickled by any other start method. Where fork
+        is unavailable, streamlines are generated serially.
+
+        :param jobs: List of (channel, intensity) tuples.
+        :return: List of results of generate_streamline, in job order.
+        """
+        workers = self.settings.streamline_workers or os.cpu_count() or 1
+        workers = min(workers, len(jobs))
+
+        if workers > 1 and multiprocessing.current_process().daemon:
+            # Daemonic processes, such as those of a batch, may not have children of their own.
+            logger.warning("Streamline workers ignored within a daemonic worker process, e.g. of a batch of frames. "
+                           "Streamlines generated serially.")
+            workers = 1
+        if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning("Parallel streamlines require the fork start method. Streamlines generated serially.")
+            workers = 1
+
+        if workers <= 1:
+            return [self.generate_streamline(job) for job in jobs]
+
+        with multiprocessing.get_context("fork").Pool(processes=workers, initializer=_init_streamline_worker,
+                                                      initargs=(self,)) as pool:
+            # Results are returned in job order, regardless of completion order.
+            return pool.map(_generate_streamline, jobs, chunksize=1)
+
+    def generate_streamline(self, job):
+        """
+        :param job: Tuple of (channel, intensity), where channel is "u" or "v".
+        :return: Tuple of the path data of each stroke of the streamline, and its counts.
+        """
+        channel, intensity = job
+        if channel == "u":
+            primary, secondary = self.surface.u_image, self.surface.v_image
+            secondary_range = self.surface.channel_range("v")
+        else:
+            primary, secondary = self.surface.v_image, self.surface.u_image
+            secondary_range = self.surface.channel_range("u")
+
+        logger.debug("Creating (%s) streamline at intensity %f...", channel, intensity)
+        streamline = Streamline(primary_uv_image_component=primary,
+                                secondary_uv_image_component=secondary,
+                                surface=self.surface,
+                                intensity=intensity,
+                                settings=self.settings,
+                                contours=self.iso_contours[channel].find_contours(intensity),
+                                secondary_range=secondary_range)
+        streamline.generate()
+
+        return [stroke.d for stroke in streamline.strokes], streamline.counts
+
+
+# Streamlines being generated by a forked worker process, set by _init_streamline_worker.
+_streamlines = None
+
+
+def _init_streamline_worker(streamlines):
+    global _streamlines
+    _streamlines = streamlines
+
+
+def _generate_streamline(job):
+    return _streamlines.generate_streamline(job)
+
 
 class Streamline:
     """
     A Streamline is a collection of Strokes which follow a specified UV intensity value.
     """
 
-    def __init__(self, primary_uv_image_component, secondary_uv_image_component, norm_image_component,
-                 surface, intensity, settings):
+    def __init__(self, primary_uv_image_component, secondary_uv_image_component, surface, intensity, settings,
+                 contours=None, secondary_range=None):
+        """
+        :param contours: Contours of the primary UV image component at the intensity, if already found.
+        :param secondary_range: Tuple of the minimum and maximum of the secondary UV image component, if already found.
+        """
         self.primary_uv_image_component = primary_uv_image_component
         self.secondary_uv_image_component = secondary_uv_image_component
-        self.norm_image_component = norm_image_component
         self.surface = surface
         self.intensity = intensity
         self.settings = settings
+        self.contours = contours
+        self.secondary_range = secondary_range
 
         self.paths = []
         self.strokes = []
+        self.counts = Counter()
 
     def generate(self):
-        contours = measure.find_contours(self.primary_uv_image_component, self.intensity)
+        contours = self.contours
+        if contours is None:
+            contours = measure.find_contours(self.primary_uv_image_component, self.intensity)
         logger.debug("Streamline contours found: %d", len(contours))
+        self.counts["contours"] += len(contours)
+
+        secondary_range = self.secondary_range
+        if secondary_range is None:
+            secondary_range = self.secondary_uv_image_component.min(), self.secondary_uv_image_component.max()
 
+        hifi_paths = []
         for contour in contours:
             # Create the rough path.
-            path = Path([[coord[1], coord[0]] for coord in contour])
+            path = Path(contour, is_rc=True)
             # Condition and create final paths.
             paths = path.round().bump(self.surface).remove_dupes() \
                 .trim_uv(target_intensity=self.intensity,
                          primary_image=self.primary_uv_image_component,
                          secondary_image=self.secondary_uv_image_component,
                          primary_trim_size=self.settings.uv_primary_trim_size,
-                         secondary_trim_size=self.settings.uv_secondary_trim_size)
+                         secondary_trim_size=self.settings.uv_secondary_trim_size,
+                         secondary_range=secondary_range)
 
+            self.counts["paths"] += len(paths)
             for path in paths:
                 logger.debug("UV contour split into %d paths.", len(paths))
 
                 hifi_path = path.simple_cull(self.settings.cull_factor)
                 fit_path = hifi_path.optimise(self.settings.optimise_factor)
 
-                num_points = len(fit_path.points)
+                num_points = len(fit_path)
                 if num_points > 1:
-
+                    hifi_paths.append(hifi_path)
                     # Store to allow plotting of construction points for debugging.
                     self.paths.append(fit_path)
-
-                    construction_curve = Curve1D(fit_path=fit_path, settings=self.settings)
-                    stroke = create_curved_stroke(construction_curve=construction_curve,
-                                                  hifi_path=hifi_path,
-                                                  thickness_parameters=self.settings.streamline_thickness_parameters,
-                                                  surface=self.surface,
-                                                  settings=self.settings)
-
-                    self.strokes.append(stroke)
                 else:
                     logger.debug("Streamline of length %d rejected", num_points)
 
+        # Fit the curves of all paths at this intensity together.
+        construction_curves = Curve1D.fit_all(self.paths, self.settings)
+        self.strokes = create_curved_strokes(construction_curves=construction_curves,
+                                             hifi_paths=hifi_paths,
+                                             thickness_parameters=self.settings.streamline_thickness_parameters,
+                                             surface=self.surface,
+                                             settings=self.settings)
+
+        for construction_curve, stroke in zip(construction_curves, self.strokes):
+            self.counts["strokes"] += 1
+            self.counts["bezier_segments"] += construction_curve.segment_count + stroke.segment_count
+
 
 class Stipples:
     """
     Stipples are a collection of SVG Stipple strokes.
     """
 
+    # Render passes read by this element.
+    passes = ("obj", "diffdir", "uv", "shadow", "ao")
+
     def __init__(self, clip_path, intersect_boundaries, surface, settings):
         self.clip_path = clip_path
         self.intersect_boundaries = intersect_boundaries
@@ -316,18 +429,25 @@ class Stipples:
 
         self.reference_image = None
         self.reference_stats = None
+        self.radius_image = None
         self.svg_strokes = []
-
-    def density_function(self, x, y):
-        min = self.settings.stipple_parameters.density_fn_min
-        factor = self.settings.stipple_parameters.density_fn_factor
-        exponent = self.settings.stipple_parameters.density_fn_exponent
-
-        density = np.maximum(min, (self.reference_image[int(round(y)), int(round(x))] ** exponent) * factor)
-
-        return density
+        self.counts = Counter()
 
     def __prepare_reference(self):
+        # The reference and radius images depend only on the lighting weights and density function, so are kept with
+        # the surface for reuse by any Stipples which differ only in threshold or stroke shape.
+        lighting_parameters = self.settings.lighting_parameters
+        stipple_parameters = self.settings.stipple_parameters
+        lighting_key = (lighting_parameters.diffdir, lighting_parameters.shadow, lighting_parameters.ao)
+        density_key = (stipple_parameters.density_fn_min, stipple_parameters.density_fn_factor,
+                       stipple_parameters.density_fn_exponent)
+
+        self.reference_image, self.reference_stats = self.surface.derived(("stipple_reference",) + lighting_key,
+                                                                          self.__compute_reference)
+        self.radius_image = self.surface.derived(("stipple_radius",) + lighting_key + density_key,
+                                                 self.__compute_radius)
+
+    def __compute_reference(self):
         # Prepare component images, where areas of high intensity will correspond to areas of dense stroke placement.
         shadow = util.invert(self.surface.shadow_image)
         ao = util.invert(self.surface.ao_image)
@@ -343,17 +463,25 @@ class Stipples:
         mask = self.surface.obj_image == 0
         combined[mask] = 0
 
-        self.reference_image = combined
-
         # Compute the mean of intensities which lie within the object boundary.
-        self.reference_stats = stats.describe(combined[util.invert(mask)])
+        return combined, stats.describe(combined[util.invert(mask)])
+
+    def __compute_radius(self):
+        # Stipple density in nodes per unit area, and from it the distance about each node within which no other is
+        # placed.
+        min = self.settings.stipple_parameters.density_fn_min
+        factor = self.settings.stipple_parameters.density_fn_factor
+        exponent = self.settings.stipple_parameters.density_fn_exponent
+
+        density = np.maximum(min, (self.reference_image ** exponent) * factor)
+
+        return 1 / np.sqrt(density)
 
     def generate(self):
         self.__prepare_reference()
 
         logger.debug("Computing Stipple nodes...")
-        y_res, x_res = self.reference_image.shape
-        nodes = moving_front_nodes(self.density_function, (0, 0, x_res - 1, y_res - 1))
+        nodes = moving_front_nodes(self.radius_image)
 
         # Nodes coords will be used as image index coords, so must be rounded.
         nodes = np.round(nodes)
@@ -373,12 +501,13 @@ class Stipples:
 
         # Extract the list of node coordinates from the image.
         nodes = np.argwhere(image)
+        self.counts["nodes"] += len(nodes)
 
         u_image = self.surface.u_image
         v_image = self.surface.v_image
 
-        # Parse intersect boundaries for use in the main loop.
-        intersect_boundaries = [svgp.parse_path(d) for d in self.intersect_boundaries]
+        # Convert intersect boundaries for use in the main loop.
+        intersect_boundaries = [curve.svgp_path for curve in self.intersect_boundaries]
 
         # Remember node coordinates remain in row, column format here.
         for node in nodes:
@@ -425,7 +554,7 @@ class Stipples:
 
             clip_path_url = "url(" + self.clip_path.get_iri() + ")"
             if self.settings.optimise_clip_paths:
-                svgp_stipple = svgp.parse_path(stipple.d)
+                svgp_stipple = stipple.svgp_path
                 found = []
                 for intersect_boundary in intersect_boundaries:
                     found += intersect_boundary.intersect(svgp_stipple)
@@ -433,6 +562,7 @@ class Stipples:
                 if found:
                     svg_stroke = svgwrite.path.Path(fill=self.settings.stroke_colour, stroke_width=0,
                                                     clip_path=clip_path_url)
+                    self.counts["clipped_stipples"] += 1
                 else:
                     svg_stroke = svgwrite.path.Path(fill=self.settings.stroke_colour, stroke_width=0)
 
@@ -442,6 +572,7 @@ class Stipples:
 
             svg_stroke.push(stipple.d)
             self.svg_strokes.append(svg_stroke)
+            self.counts["stipples"] += 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,401 @@
+"""
+NumPy implementation of the Schneider curve fitting algorithm of third_party/PathFitter.py.
+
+Points are held in (N, 2) arrays. Rather than recursing into each region of points which fails to fit, regions are kept
+on a work list and processed in rounds: each round applies one step of the fit (least-squares control points, error
+measurement and Newton-Raphson reparameterisation) to every pending region of every path in the batch at once. Within a
+round regions are padded to a common length, grouped by length to limit the padding.
+
+The arithmetic follows the port operation for operation, so that the fitted curves are the same: sums are accumulated
+sequentially with np.cumsum over rows padded with trailing zeros, and lengths use math.hypot, matching the Point class.
+
+Fitted curves are returned as (S, 4, 2) arrays, holding the start, first control, second control and end point of each
+of S cubic Bezier segments.
+"""
+
+import math
+
+import numpy as np
+
+TOLERANCE = 10e-6
+# Changed from 1e-11 in PathFitter to reduce issues with wisps on resultant curves.
+EPSILON = 1e-02
+# Number of least-squares fits attempted for a region before it is split.
+MAX_ITERATIONS = 5
+
+
+def hypot_rows(vectors):
+    # math.hypot, as used by the Point class, and np.hypot may differ in the last place.
+    return np.array([math.hypot(x, y) for x, y in vectors.tolist()]).reshape(len(vectors))
+
+
+def scale_rows(vectors, lengths, scale):
+    """
+    :return: Vectors of the given lengths multiplied by scale / length, or zero vectors where the length is zero.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = np.where(lengths != 0, scale / lengths, 0)
+    return vectors * factors[..., np.newaxis]
+
+
+def normalize_rows(vectors, length=1):
+    return scale_rows(vectors, hypot_rows(vectors), length)
+
+
+def dot(a, b):
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]
+
+
+def evaluate(curves, t):
+    """
+    :param curves: (R, D + 1, 2) array of the control points of R Bezier curves of degree D.
+    :param t: (R, M) array of parameter values for each curve.
+    :return: (R, M, 2) array of the points on each curve at its parameter values, by de Casteljau's algorithm.
+    """
+    t = t[:, np.newaxis, :, np.newaxis]
+    s = 1 - t
+    tmp = curves[:, :, np.newaxis, :]
+    # Each pass interpolates between all adjacent pairs of the previous pass's points.
+    for _ in range(curves.shape[1] - 1):
+        tmp = tmp[:, :-1] * s + tmp[:, 1:] * t
+    return tmp[:, 0]
+
+
+def length_groups(lengths):
+    """
+    :return: List of arrays of the indices of the lengths which fall between consecutive powers of two.
+    """
+    groups = np.ceil(np.log2(lengths)).astype(int)
+    return [np.flatnonzero(groups == group) for group in np.unique(groups)]
+
+
+class Regions:
+    """
+    Regions of points to be fitted, holding for each region: the indices of its first and last points, the tangents at
+    either end, the error against which an improved fit is judged and the number of fits attempted.
+    """
+
+    fields = ("first", "last", "tan1", "tan2", "max_error", "iteration")
+
+    def __init__(self, first, last, tan1, tan2, max_error=None, iteration=None):
+        self.first = first
+        self.last = last
+        self.tan1 = tan1
+        self.tan2 = tan2
+        self.max_error = max_error if max_error is not None else np.zeros(len(first))
+        self.iteration = iteration if iteration is not None else np.zeros(len(first), dtype=int)
+
+    def __len__(self):
+        return len(self.first)
+
+    def __getitem__(self, selection):
+        return Regions(*[getattr(self, name)[selection] for name in self.fields])
+
+    @staticmethod
+    def concatenate(regions):
+        return Regions(*[np.concatenate([getattr(region, name) for region in regions]) for name in Regions.fields])
+
+
+class CurveFitter:
+    """
+    Fits a composite cubic Bezier curve to each of a batch of point sequences.
+    """
+
+    def __init__(self, paths, error=2.5):
+        paths = [np.array(points, dtype=float).reshape(-1, 2) for points in paths]
+        points = np.concatenate(paths) if paths else np.empty((0, 2))
+        path_starts = np.cumsum([0] + [len(path) for path in paths])
+
+        # Filter out adjacent duplicates within each path.
+        keep = np.ones(len(points), dtype=bool)
+        keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+        keep[path_starts[:-1][path_starts[:-1] < len(points)]] = True
+        self.points = points[keep]
+        # Number of points kept from the paths before each path.
+        kept = np.concatenate([[0], np.cumsum(keep)])
+        self.path_starts = kept[path_starts]
+        self.error = error
+
+        # Distance from each point to the next. Distances between the last point of a path and the first of the next
+        # are never used.
+        self.distances = hypot_rows(np.diff(self.points, axis=0))
+        # Parameter value of each interior point of the regions being fitted. Regions being fitted never share interior
+        # points, and the first and last points of a region are always at 0 and 1, so one array serves all regions.
+        self.u = np.zeros(len(self.points))
+
+    def fit(self):
+        """
+        :return: List of (S, 4, 2) arrays of the control points of the segments fitted to each path. S is 0 if there
+                 are fewer than two distinct points in the path.
+        """
+        points = self.points
+        path_count = len(self.path_starts) - 1
+        if not path_count:
+            return []
+
+        curves = []
+        firsts = []
+        # Regions of only two points are fitted together once all others are done.
+        pairs = []
+
+        first = self.path_starts[:-1]
+        last = self.path_starts[1:] - 1
+        valid = last > first
+        first, last = first[valid], last[valid]
+        pending = [Regions(first, last,
+                           # Left tangent.
+                           normalize_rows(points[first + 1] - points[first]),
+                           # Right tangent.
+                           normalize_rows(points[last - 1] - points[last]))]
+
+        while pending:
+            regions = Regions.concatenate(pending)
+            pending = []
+
+            is_pair = regions.last - regions.first == 1
+            pairs.append(regions[is_pair])
+            regions = regions[~is_pair]
+            if not len(regions):
+                break
+
+            # Parameterize the points of new regions.
+            new = regions.iteration == 0
+            regions.max_error[new] = max(self.error, self.error * self.error)
+            self.chord_length_parameterize(regions.first[new], regions.last[new])
+
+            # Attempt to fit curves.
+            fitted = np.empty((len(regions), 4, 2))
+            max_err = np.empty(len(regions))
+            max_index = np.empty(len(regions), dtype=int)
+            for group in length_groups(regions.last - regions.first + 1):
+                fitted[group] = self.generate_bezier(regions[group])
+                # Find max deviation of points to fitted curve.
+                max_err[group], max_index[group] = self.find_max_error(regions[group], fitted[group])
+
+            accepted = max_err < self.error
+            curves.append(fitted[accepted])
+            firsts.append(regions.first[accepted])
+
+            # If error not too large, try reparameterization and iteration.
+            retry = ~accepted & (max_err < regions.max_error) & (regions.iteration < MAX_ITERATIONS - 1)
+            retried = regions[retry]
+            for group in length_groups(retried.last - retried.first + 1):
+                self.reparameterize(retried[group], fitted[retry][group])
+            retried.max_error = max_err[retry]
+            retried.iteration = retried.iteration + 1
+            pending.append(retried)
+
+            # Fitting failed, split at max error point and fit each side.
+            split = ~accepted & ~retry
+            failed = regions[split]
+            split_index = max_index[split]
+            v1 = points[split_index - 1] - points[split_index]
+            v2 = points[split_index] - points[split_index + 1]
+            tan_center = normalize_rows((v1 + v2) / 2)
+            pending.append(Regions(failed.first, split_index, failed.tan1, tan_center))
+            pending.append(Regions(split_index, failed.last, -tan_center, failed.tan2))
+
+        pairs = Regions.concatenate(pairs)
+        curves.append(self.fit_pairs(pairs))
+        firsts.append(pairs.first)
+
+        # Regions do not overlap, so ordering curves by their first point orders them along each path.
+        firsts = np.concatenate(firsts)
+        order = np.argsort(firsts, kind="stable")
+        curves = np.concatenate(curves)[order]
+        # The port stores control points as handles relative to the end points, and adds them back when writing SVG.
+        curves[:, 1] = curves[:, 0] + (curves[:, 1] - curves[:, 0])
+        curves[:, 2] = curves[:, 3] + (curves[:, 2] - curves[:, 3])
+
+        path_indices = np.searchsorted(self.path_starts, firsts[order], side="right") - 1
+        counts = np.bincount(path_indices, minlength=path_count)
+        return np.split(curves, np.cumsum(counts)[:-1])
+
+    @staticmethod
+    def gather(first, last):
+        """
+        :return: (R, M) arrays of the indices of each region's points, padded with the index of its last point, and of
+                 a mask which is True for the region's points. M is the length of the longest region.
+        """
+        columns = np.arange((last - first).max() + 1)
+        indices = np.minimum(first[:, np.newaxis] + columns, last[:, np.newaxis])
+        mask = columns <= (last - first)[:, np.newaxis]
+        return indices, mask
+
+    @staticmethod
+    def interior(first, last, mask):
+        """
+        :return: The mask of each region's points, excluding its first and last points.
+        """
+        columns = np.arange(mask.shape[1])
+        return mask & (columns > 0) & (columns < (last - first)[:, np.newaxis])
+
+    def parameters(self, first, last):
+        """
+        :return: (R, M) array of the parameter values of each region's points, padded with 1.
+        """
+        indices, mask = self.gather(first, last)
+        u = np.where(mask, self.u[indices], 1)
+        u[:, 0] = 0
+        u[np.arange(len(first)), last - first] = 1
+        return u
+
+    def chord_length_parameterize(self, first, last):
+        """
+        Assign parameter values to each region's points, using relative distances between points.
+        """
+        for group in length_groups(last - first + 1):
+            group_first, group_last = first[group], last[group]
+            # Cumulative distance to each point after the first.
+            indices, mask = self.gather(group_first, group_last - 1)
+            cumulative = np.cumsum(np.where(mask, self.distances[indices], 0), axis=1)
+            total = cumulative[np.arange(len(group)), group_last - group_first - 1]
+
+            # The last point is always at 1.
+            interior = mask & (np.arange(mask.shape[1]) < (group_last - group_first - 1)[:, np.newaxis])
+            self.u[indices[interior] + 1] = (cumulative / total[:, np.newaxis])[interior]
+
+    def generate_bezier(self, regions):
+        """
+        Use the least-squares method to find Bezier control points for each region.
+
+        :return: (R, 4, 2) array of the control points of the curve fitted to each region.
+        """
+        indices, mask = self.gather(regions.first, regions.last)
+        u_prime = self.parameters(regions.first, regions.last)
+        pt1 = self.points[regions.first]
+        pt2 = self.points[regions.last]
+        tan1, tan2 = regions.tan1, regions.tan2
+        length1 = hypot_rows(tan1)
+        length2 = hypot_rows(tan2)
+
+        t = 1 - u_prime
+        b = 3 * u_prime * t
+        b0 = t * t * t
+        b1 = b * t
+        b2 = b * u_prime
+        b3 = u_prime * u_prime * u_prime
+        a1 = scale_rows(tan1[:, np.newaxis], length1[:, np.newaxis], b1)
+        a2 = scale_rows(tan2[:, np.newaxis], length2[:, np.newaxis], b2)
+        tmp = self.points[indices] - pt1[:, np.newaxis] * (b0 + b1)[..., np.newaxis] - \
+            pt2[:, np.newaxis] * (b2 + b3)[..., np.newaxis]
+
+        # Create the C and X matrices. Sums are accumulated in order, as a Python loop would, rather than with the
+        # pairwise summation of np.sum.
+        products = np.where(mask, np.stack([dot(a1, a1), dot(a1, a2), dot(a2, a2), dot(a1, tmp), dot(a2, tmp)]), 0)
+        c00, c01, c11, x0, x1 = np.cumsum(products, axis=2)[:, :, -1]
+        c10 = c01
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Compute the determinants of C and X.
+            det_c0_c1 = c00 * c11 - c10 * c01
+            # Kramer's rule.
+            det_c0_x = c00 * x1 - c10 * x0
+            det_x_c1 = x0 * c11 - x1 * c01
+            # Where the matrix is under-determined, try assuming alpha1 == alpha2.
+            c0 = c00 + c01
+            c1 = c10 + c11
+            alpha = np.where(np.abs(c0) > EPSILON, x0 / c0, np.where(np.abs(c1) > EPSILON, x1 / c1, 0))
+            # Derive alpha values.
+            determined = np.abs(det_c0_c1) > EPSILON
+            alpha1 = np.where(determined, det_x_c1 / det_c0_c1, alpha)
+            alpha2 = np.where(determined, det_c0_x / det_c0_c1, alpha)
+
+        # If alpha is negative, use the Wu/Barsky heuristic. If alpha is 0, coincident control points would lead to a
+        # divide by zero in any subsequent Newton-Raphson iteration.
+        seg_length = hypot_rows(pt2 - pt1)
+        epsilon = EPSILON * seg_length
+        # Fall back on standard (probably inaccurate) formula, and subdivide further if needed.
+        heuristic = (alpha1 < epsilon) | (alpha2 < epsilon)
+        alpha1 = np.where(heuristic, seg_length / 3, alpha1)
+        alpha2 = np.where(heuristic, seg_length / 3, alpha2)
+
+        # First and last control points of the Bezier curve are positioned exactly at the first and last data points.
+        # Control points 1 and 2 are positioned an alpha distance out on the tangent vectors, left and right.
+        return np.stack([pt1, pt1 + scale_rows(tan1, length1, alpha1), pt2 + scale_rows(tan2, length2, alpha2), pt2],
+                        axis=1)
+
+    def find_max_error(self, regions, curves):
+        """
+        :return: Arrays of the maximum squared distance of each region's points to its fitted curve, and of the index
+                 of the point at which it occurs. The last of several equal maxima is taken.
+        """
+        indices, mask = self.gather(regions.first, regions.last)
+        v = evaluate(curves, self.parameters(regions.first, regions.last)) - self.points[indices]
+        dist = v[..., 0] * v[..., 0] + v[..., 1] * v[..., 1]
+
+        # Only interior points are measured. Distances are never negative, so -1 is never the maximum.
+        dist = np.where(self.interior(regions.first, regions.last, mask), dist, -1)
+        index = mask.shape[1] - 1 - np.argmax(dist[:, ::-1], axis=1)
+        return dist[np.arange(len(regions)), index], regions.first + index
+
+    def reparameterize(self, regions, curves):
+        """
+        Improve the parameter values of each region's points by a Newton-Raphson iteration.
+        """
+        indices, mask = self.gather(regions.first, regions.last)
+        u = self.parameters(regions.first, regions.last)
+
+        # Generate control vertices for Q' and Q''.
+        curves1 = (curves[:, 1:] - curves[:, :-1]) * 3
+        curves2 = (curves1[:, 1:] - curves1[:, :-1]) * 2
+
+        # Compute Q(u), Q'(u) and Q''(u).
+        pt = evaluate(curves, u)
+        pt1 = evaluate(curves1, u)
+        pt2 = evaluate(curves2, u)
+        diff = pt - self.points[indices]
+        df = dot(pt1, pt1) + dot(diff, pt2)
+
+        # u = u - f(u) / f'(u), unless f'(u) vanishes. The first and last points stay at 0 and 1, as the curve passes
+        # through them.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = np.where(np.abs(df) < TOLERANCE, u, u - dot(diff, pt1) / df)
+        interior = self.interior(regions.first, regions.last, mask)
+        self.u[indices[interior]] = u[interior]
+
+    def fit_pairs(self, regions):
+        """
+        Use heuristic for regions which only have two points in them.
+
+        :return: (R, 4, 2) array of the control points of the curve fitted to each region.
+        """
+        pt1 = self.points[regions.first]
+        pt2 = self.points[regions.last]
+        dist = self.distances[regions.first] / 3
+
+        return np.stack([pt1, pt1 + normalize_rows(regions.tan1, dist), pt2 + normalize_rows(regions.tan2, dist), pt2],
+                        axis=1).reshape(-1, 4, 2)
+
+
+def fit_curve(points, error):
+    """
+    :param points: Sequence of (x, y) points.
+    :param error: Maximum error allowed between points and the fitted curve.
+    :return: (S, 4, 2) array of the control points of the fitted segments.
+    """
+    return CurveFitter([points], error).fit()[0]
+
+
+def fit_curves(paths, error):
+    """
+    Fit curves to a batch of paths at once, which is much faster than fitting each path separately when there are
+    many short paths.
+
+    :param paths: Sequence of sequences of (x, y) points.
+    :param error: Maximum error allowed between points and the fitted curves.
+    :return: List of (S, 4, 2) arrays of the control points of the segments fitted to each path.
+    """
+    return CurveFitter(paths, error).fit()
+
+
+def curves_from_segments(segments):
+    """
+    :param segments: List of PathFitter Segments, as returned by PathFitter.fitpath.
+    :return: (S, 4, 2) array of the control points of the curves between consecutive segments.
+    """
+    curves = [[[a.point.x, a.point.y],
+               [a.point.x + a.handleOut.x, a.point.y + a.handleOut.y],
+               [b.point.x + b.handleIn.x, b.point.y + b.handleIn.y],
+               [b.point.x, b.point.y]] for a, b in zip(segments[:-1], segments[1:])]
+    return np.array(curves, dtype=float).reshape(-1, 4, 2)
@@ -5,61 +5,136 @@ import svgwrite
 
 from blender_hand_drawn_npr.model.elements import Silhouette, InternalEdges, Streamlines, Stipples
 from blender_hand_drawn_npr.model.data import Surface
+from blender_hand_drawn_npr.model.instrumentation import Instrumentation
 
 logger = logging.getLogger(__name__)
 
+# Render pass images written by the compositor, keyed by the name of the pass they represent. File names are
+# formatted with the frame number.
+PASS_FILENAMES = {"obj": "IndexOB{:04d}.png",
+                  "z": "Depth{:04d}.png",
+                  "diffdir": "DiffDir{:04d}.png",
+                  "norm": "Normal{:04d}.tif",
+                  "uv": "UV{:04d}.tif",
+                  "shadow": "Shadow{:04d}.png",
+                  "ao": "AO{:04d}.png"}
+
 
 class Illustrator:
 
-    def __init__(self, settings):
+    def __init__(self, settings, frame=1):
         self.settings = settings
+        self.frame = frame
+
+        self.instrumentation = Instrumentation()
+
+        # Load the render pass images needed by the enabled elements from disk. Remaining passes are only loaded
+        # should they be accessed.
+        file_paths = {name: os.path.join(self.settings.in_path, filename.format(frame))
+                      for name, filename in PASS_FILENAMES.items()}
+        required_passes = self.required_passes()
+        logger.info("Required passes: %s", ", ".join(required_passes))
+
+        with self.instrumentation.stage("load") as counts:
+            self.surface = Surface(use_cache=self.settings.cache_passes)
+            self.surface.add_pass_files(file_paths)
+            self.surface.init_images({name: file_paths[name] for name in required_passes},
+                                     max_workers=self.settings.load_workers)
+            counts["passes"] += len(required_passes)
+
+        # The illustration always covers the full frame.
+        self.dimensions = (self.surface.obj_image.shape[1],
+                           self.surface.obj_image.shape[0])
+        self.illustration = svgwrite.Drawing(self.settings.out_filepath, self.dimensions)
+        # Container for all strokes.
+        self.layer = self.illustration
+
+        if self.settings.roi_padding is not None:
+            # Restrict processing to the region around the subject. Padding must be at least the Harris min_distance,
+            # as corner_peaks excludes peaks closer than this to the image border.
+            padding = max(self.settings.roi_padding, self.settings.harris_min_distance)
+            region = self.surface.object_region(padding)
+
+            if region is not None:
+                self.surface.crop(region)
+                # Strokes are computed relative to the region, so translate them back into the full frame.
+                self.layer = self.illustration.add(self.illustration.g(
+                    transform="translate({}, {})".format(region[1], region[0])))
+            else:
+                logger.warning("No object found, region of interest cropping skipped.")
+
+        if self.settings.compact_surface:
+            self.surface.compact()
+        logger.info("Surface memory footprint: %.1f MB", self.surface.nbytes / 2 ** 20)
 
-        # Load render pass images from disk.
-        self.surface = Surface()
-        self.surface.init_obj_image(os.path.join(self.settings.in_path, "IndexOB0001.png"))
-        self.surface.init_z_image(os.path.join(self.settings.in_path, "Depth0001.png"))
-        self.surface.init_diffdir_image(os.path.join(self.settings.in_path, "DiffDir0001.png"))
-        self.surface.init_norm_image(os.path.join(self.settings.in_path, "Normal0001.tif"))
-        self.surface.init_uv_image(os.path.join(self.settings.in_path, "UV0001.tif"))
-        self.surface.init_shadow_image(os.path.join(self.settings.in_path, "Shadow0001.png"))
-        self.surface.init_ao_image(os.path.join(self.settings.in_path, "AO0001.png"))
+        self.intersect_boundaries = []
 
-        illustration_dimensions = (self.surface.obj_image.shape[1],
-                                   self.surface.obj_image.shape[0])
-        self.illustration = svgwrite.Drawing(self.settings.out_filepath, illustration_dimensions)
+    def required_passes(self):
+        """
+        :return: Names of the render passes read by the elements enabled in the settings.
+        """
+        elements = [Silhouette]
+        if self.settings.enable_internal_edges:
+            elements.append(InternalEdges)
+        if self.settings.enable_streamlines:
+            elements.append(Streamlines)
+        if self.settings.enable_stipples:
+            elements.append(Stipples)
 
-        self.intersect_boundaries = []
+        return tuple(name for name in PASS_FILENAMES if any(name in element.passes for element in elements))
 
     def illustrate(self):
+        with self.instrumentation.stage("illustrate"):
+            self.__illustrate()
+
+    def __illustrate(self):
         # Silhouettes are essential to generate as they are used for clipping paths.
-        silhouette = Silhouette(surface=self.surface, settings=self.settings)
-        silhouette.generate()
-        [self.illustration.add(svg_stroke) for svg_stroke in silhouette.svg_strokes]
+        with self.instrumentation.stage("silhouette") as counts:
+            silhouette = Silhouette(surface=self.surface, settings=self.settings)
+            silhouette.generate()
+            counts.update(silhouette.counts)
+        [self.layer.add(svg_stroke) for svg_stroke in silhouette.svg_strokes]
         [self.intersect_boundaries.append(boundary_curve) for boundary_curve in silhouette.boundary_curves]
         clip_path = self.illustration.defs.add(self.illustration.clipPath(id='silhouette_clip_path'))
         clip_path.add(svgwrite.path.Path(silhouette.clip_path_d))
 
         if self.settings.enable_internal_edges:
-            internal_edges = InternalEdges(surface=self.surface, settings=self.settings)
-            internal_edges.generate()
-            [self.illustration.add(svg_stroke) for svg_stroke in internal_edges.svg_strokes]
+            with self.instrumentation.stage("internal_edges") as counts:
+                internal_edges = InternalEdges(surface=self.surface, settings=self.settings)
+                internal_edges.generate()
+                counts.update(internal_edges.counts)
+            [self.layer.add(svg_stroke) for svg_stroke in internal_edges.svg_strokes]
 
         if self.settings.enable_streamlines:
-            streamlines = Streamlines(surface=self.surface, settings=self.settings)
-            streamlines.generate()
-            [self.illustration.add(svg_stroke) for svg_stroke in streamlines.svg_strokes]
+            with self.instrumentation.stage("streamlines") as counts:
+                streamlines = Streamlines(surface=self.surface, settings=self.settings)
+                streamlines.generate()
+                counts.update(streamlines.counts)
+            [self.layer.add(svg_stroke) for svg_stroke in streamlines.svg_strokes]
 
         if self.settings.enable_stipples:
-            stipples = Stipples(clip_path=clip_path, intersect_boundaries=self.intersect_boundaries,
-                                surface=self.surface, settings=self.settings)
-            stipples.generate()
-            [self.illustration.add(svg_stroke) for svg_stroke in stipples.svg_strokes]
+            with self.instrumentation.stage("stipples") as counts:
+                stipples = Stipples(clip_path=clip_path, intersect_boundaries=self.intersect_boundaries,
+                                    surface=self.surface, settings=self.settings)
+                stipples.generate()
+                counts.update(stipples.counts)
+            [self.layer.add(svg_stroke) for svg_stroke in stipples.svg_strokes]
 
     def save(self):
-        self.illustration.save()
+        with self.instrumentation.stage("save"):
+            self.illustration.save()
 
         logger.info("Illustration saved to: %s", self.settings.out_filepath)
 
+        if self.settings.write_report:
+            # Place the report next to the illustration.
+            report_filepath = os.path.splitext(self.settings.out_filepath)[0] + ".report.json"
+            self.instrumentation.save(report_filepath,
+                                      out_filepath=self.settings.out_filepath,
+                                      frame=self.frame,
+                                      dimensions=self.dimensions,
+                                      region=self.surface.region)
+
 
 if __name__ == "__main__":
 
@@ -71,6 +146,7 @@ if __name__ == "__main__":
                         cull_factor=50,
                         optimise_factor=5,
                         curve_fit_error=0.01,
+                        curve_fitter="numpy",
                         harris_min_distance=40,
                         subpix_window_size=20,
                         curve_sampling_interval=20,
@@ -94,6 +170,12 @@ if __name__ == "__main__":
                         enable_internal_edges=True,
                         enable_streamlines=True,
                         enable_stipples=True,
+                        load_workers=None,
+                        streamline_workers=1,
+                        cache_passes=False,
+                        compact_surface=False,
+                        roi_padding=32,
+                        write_report=True,
                         in_path="/tmp/")
 
     illustrator = Illustrator(settings)
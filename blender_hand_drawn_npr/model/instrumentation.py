@@ -0,0 +1,134 @@
+import json
+import logging
+import sys
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is not reported.
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss(who=None):
+    """
+    :param who: resource.RUSAGE_SELF (the default) for the current process, or resource.RUSAGE_CHILDREN for the
+                largest of its terminated child processes which have been waited for.
+    :return: Peak resident set size in bytes, or None if this can not be determined.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # Reported in bytes on macOS, but kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def children_peak_rss():
+    """
+    :return: Peak resident set size in bytes of the largest terminated child process of the current process which has
+             been waited for, or None if this can not be determined.
+    """
+    if resource is None:
+        return None
+
+    return peak_rss(resource.RUSAGE_CHILDREN)
+
+
+def children_cpu_time():
+    """
+    :return: Total user and system CPU time in seconds of the terminated child processes of the current process which
+             have been waited for, or None if this can not be determined.
+    """
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def difference(start, end):
+    """
+    :return: end - start, or None if either can not be determined.
+    """
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+class Instrumentation:
+    """
+    Instrumentation records the wall time, CPU time and peak memory of named processing stages, along with counts of
+    the items (contours, paths, strokes etc.) that each stage produces. Only a few clock reads are made per stage, so
+    it is cheap enough to leave enabled.
+
+    The CPU time of a stage is split between cpu_time, that of this process alone, and children_cpu_time, that of any
+    worker processes which ran and exited during the stage (e.g. parallel streamline workers).
+
+    Only the peak memory of a process is known, not its memory at a point in time, so a stage records by how much it
+    raised the peak: peak_rss_increase for this process, and children_peak_rss_increase for the largest of its worker
+    processes. A stage which stays below the peak set by an earlier stage records no increase.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counts = Counter()
+        self.__start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Record a stage spanning the body of a with statement.
+
+        :param name: Stage name.
+        :return: Counter to which counts for the stage may be added.
+        """
+        counts = Counter()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        children_start = children_cpu_time()
+        rss_start = peak_rss()
+        children_rss_start = children_peak_rss()
+
+        try:
+            yield counts
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            self.stages[name] = OrderedDict([("wall_time", wall_time),
+                                             ("cpu_time", time.process_time() - cpu_start),
+                                             ("children_cpu_time", difference(children_start, children_cpu_time())),
+                                             ("peak_rss_increase", difference(rss_start, peak_rss())),
+                                             ("children_peak_rss_increase",
+                                              difference(children_rss_start, children_peak_rss())),
+                                             ("counts", dict(counts))])
+            self.counts.update(counts)
+            logger.info("Stage '%s' completed in %.3f s", name, wall_time)
+
+    def report(self, **info):
+        """
+        :param info: Additional values to include in the report.
+        :return: Dict of all recorded measurements.
+        """
+        report = OrderedDict(info)
+        report["wall_time"] = time.perf_counter() - self.__start
+        report["peak_rss"] = peak_rss()
+        report["children_peak_rss"] = children_peak_rss()
+        report["counts"] = dict(self.counts)
+        report["stages"] = self.stages
+        return report
+
+    def save(self, file_path, **info):
+        """
+        Write the report as JSON.
+
+        :param file_path: Output file path.
+        :param info: Additional values to include in the report.
+        """
+        with open(file_path, "w") as report_file:
+            json.dump(self.report(**info), report_file, indent=2)
+
+        logger.info("Instrumentation report saved to: %s", file_path)
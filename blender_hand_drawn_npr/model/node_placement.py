@@ -0,0 +1,132 @@
+"""
+Moving front node placement by the algorithm of Fornberg and Flyer, as third_party/variable_density.py, in time which
+grows with the number of nodes rather than with the number of nodes times the length of the front.
+
+The front is held in a heap keyed by y, from which the lowest point is popped, and in a grid of square cells, from which
+the points near it are found. Rather than measuring the distance from the lowest point to every point of the front on
+each iteration, only the few cells that can hold points within the placement radius, or nearer than the nearest
+neighbour found so far, are searched. All front points lie at or above the lowest, and at or below the highest point
+inserted, so only the rows of cells between these are searched.
+
+The placement radius is read from an image rather than computed by a callback for each node.
+"""
+
+import heapq
+import math
+
+import numpy as np
+
+
+def moving_front_nodes(radius_image, init_pts=500, new_pts=5):
+    """
+    Place nodes over the image such that each is separated from the nodes placed before it by the radius at its
+    location.
+
+    :param radius_image: (H, W) array of the radius about each pixel within which no further nodes are placed. For a
+                         density in nodes per unit area, this is 1 / sqrt(density).
+    :param init_pts: Number of initial front points, placed at random along the top row of the image.
+    :param new_pts: Number of front points added about each node placed.
+    :return: (N, 2) array of the x, y coordinates of the nodes, in order of placement.
+    """
+    height, width = radius_image.shape
+    x1, y1, x2, y2 = 0, 0, width - 1, height - 1
+
+    # Cells are at least as large as any radius, so points within the radius of the lowest lie in adjacent cells.
+    cell_size = max(float(radius_image.max()), 1.0)
+
+    xs, ys = [], []
+    alive = []
+    heap = []
+    grid = {}
+    max_y = -math.inf
+
+    def insert(x, y):
+        index = len(xs)
+        xs.append(x)
+        ys.append(y)
+        alive.append(True)
+        # Ties in y are broken by order of insertion. The initial points are inserted in random order of x.
+        heapq.heappush(heap, (y, index))
+        grid.setdefault((int(x // cell_size), int(y // cell_size)), []).append(index)
+
+    for x in np.random.uniform(x1, x2, (init_pts,)).tolist():
+        insert(x, float(y1))
+        max_y = max(max_y, y1)
+
+    nodes = []
+    while heap:
+        y, index = heapq.heappop(heap)
+        if not alive[index]:
+            continue
+        if y >= y2:
+            break
+
+        x = xs[index]
+        radius = radius_image.item(min(max(int(round(y)), 0), height - 1), int(round(x)))
+        nodes.append((x, y))
+
+        col, row = int(x // cell_size), int(y // cell_size)
+        rows = range(row, int(max_y // cell_size) + 1)
+
+        # Remove the points within the radius, including the lowest itself.
+        for c in (col - 1, col, col + 1):
+            for r in rows[:2]:
+                cell = grid.get((c, r))
+                if not cell:
+                    continue
+                retained = []
+                for i in cell:
+                    if math.hypot(xs[i] - x, ys[i] - y) < radius:
+                        alive[i] = False
+                    else:
+                        retained.append(i)
+                grid[(c, r)] = retained
+
+        a_left = nearest_angle(x, y, col, rows, -1, int(x1 // cell_size), cell_size, grid, xs, ys)
+        a_right = nearest_angle(x, y, col, rows, 1, int(x2 // cell_size), cell_size, grid, xs, ys)
+        if abs(a_right - math.pi) < 1e-8:
+            a_right = -math.pi
+
+        # Space the new points evenly within the sector between the neighbours, but not on its edges.
+        step = (a_right - a_left) / new_pts
+        for i in range(new_pts):
+            angle = a_left + i * step + step / 2
+            new_x = x + math.cos(angle) * radius
+            new_y = y - math.sin(angle) * radius
+            if x1 <= new_x <= x2:
+                insert(new_x, new_y)
+                max_y = max(max_y, new_y)
+
+    return np.array(nodes).reshape((len(nodes), 2))
+
+
+def nearest_angle(x, y, col, rows, direction, last_col, cell_size, grid, xs, ys):
+    """
+    Find the nearest front point to one side of (x, y), searching columns of cells outwards from col until no nearer
+    point can remain.
+
+    :param direction: -1 to search for points to the left of x, or 1 for points to the right.
+    :param last_col: Last column of cells to search.
+    :return: Angle of the vector from the nearest point to (x, y), or -pi / 2 if there is no point to that side.
+    """
+    nearest = None
+    nearest_distance = math.inf
+
+    c = col
+    while (c - last_col) * direction <= 0:
+        # Distance from x to the near edge of the column.
+        gap = (x - (c + 1) * cell_size) if direction < 0 else (c * cell_size - x)
+        if gap >= nearest_distance:
+            break
+
+        for r in rows:
+            for i in grid.get((c, r), ()):
+                if (xs[i] - x) * direction > 0:
+                    distance = math.hypot(xs[i] - x, ys[i] - y)
+                    if distance < nearest_distance:
+                        nearest, nearest_distance = i, distance
+        c += direction
+
+    if nearest is None:
+        return -math.pi / 2
+    return math.atan2(y - ys[nearest], x - xs[nearest])
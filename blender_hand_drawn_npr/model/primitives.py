@@ -1,20 +1,242 @@
 import logging
-import math
-from collections import deque
 
 import numpy as np
 import svgpathtools as svgp
 import svgwrite
-from more_itertools import unique_everseen
-from scipy import arange, spatial
-from scipy.interpolate import interp1d
-from skimage import measure, util
+from scipy import spatial
+from skimage import measure
 from skimage.feature import corner_harris, corner_peaks, corner_subpix
 
 import blender_hand_drawn_npr.model.third_party.PathFitter as pf
+from blender_hand_drawn_npr.model.fitting import fit_curve, fit_curves, curves_from_segments
 
 logger = logging.getLogger(__name__)
 
+# Gauss-Legendre quadrature over each quarter of the parameter domain of a Bezier segment, as (nodes, weights).
+GAUSS_LEGENDRE_NODES, GAUSS_LEGENDRE_WEIGHTS = np.polynomial.legendre.leggauss(16)
+GAUSS_LEGENDRE_NODES = ((GAUSS_LEGENDRE_NODES + 1) / 8 + np.arange(4)[:, np.newaxis] / 4).ravel()
+GAUSS_LEGENDRE_WEIGHTS = np.tile(GAUSS_LEGENDRE_WEIGHTS / 8, 4)
+
+
+# The bezier_ functions evaluate many cubic Bezier segments at once, giving the same results as the corresponding
+# svgpathtools CubicBezier methods.
+
+def bezier_points(control_points, t):
+    """
+    :param control_points: (N, 4) complex array of the start, first control, second control and end point of N
+                           segments.
+    :param t: Array of N parameter values, one for each segment.
+    :return: Complex array of the point on each segment at its parameter value.
+    """
+    p0, p1, p2, p3 = control_points.T
+    # Horner's rule.
+    return p0 + t * (3 * (p1 - p0) + t * (3 * (p0 + p2) - 6 * p1 + t * (-p0 + 3 * (p1 - p2) + p3)))
+
+
+def bezier_derivatives(control_points, t, n=1):
+    """
+    :param control_points: (N, 4) complex array of segment control points.
+    :param t: Array of N parameter values.
+    :param n: Order of the derivative, 1 or 2.
+    :return: Complex array of the nth derivative of each segment at its parameter value.
+    """
+    p0, p1, p2, p3 = control_points.T
+    if n == 1:
+        return 3 * (p1 - p0) * (1 - t) ** 2 + 6 * (p2 - p1) * (1 - t) * t + 3 * (p3 - p2) * t ** 2
+    elif n == 2:
+        return 6 * ((1 - t) * (p2 - 2 * p1 + p0) + t * (p3 - 2 * p2 + p1))
+    else:
+        raise ValueError("n should be 1 or 2.")
+
+
+def bezier_normals(control_points, t):
+    """
+    :param control_points: (N, 4) complex array of segment control points.
+    :param t: Array of N parameter values.
+    :return: Complex array of the (right hand rule) unit normal of each segment at its parameter value.
+    """
+    derivatives = bezier_derivatives(control_points, t)
+    # np.abs of complex values may differ from the built-in abs in the last place, np.hypot does not.
+    speeds = np.hypot(derivatives.real, derivatives.imag)
+
+    # Divide each component by the speed, as NumPy divides complex values by real values less accurately.
+    tangents = np.empty_like(derivatives)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tangents.real = derivatives.real / speeds
+        tangents.imag = derivatives.imag / speeds
+    # Where the derivative vanishes the tangent is a limit, which svgpathtools can find.
+    for i in np.flatnonzero(speeds == 0):
+        tangents[i] = svgp.CubicBezier(*control_points[i]).unit_tangent(t[i])
+
+    return -1j * tangents
+
+
+def bezier_curvatures(control_points, t):
+    """
+    :param control_points: (N, 4) complex array of segment control points.
+    :param t: Array of N parameter values.
+    :return: Array of the curvature of each segment at its parameter value.
+    """
+    dz = bezier_derivatives(control_points, t)
+    ddz = bezier_derivatives(control_points, t, n=2)
+    dx, dy = dz.real, dz.imag
+    ddx, ddy = ddz.real, ddz.imag
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        curvatures = np.abs(dx * ddy - dy * ddx) / np.sqrt(dx * dx + dy * dy) ** 3
+    # Where the derivative vanishes the curvature is a limit, which svgpathtools can find.
+    for i in np.flatnonzero((dx == 0) & (dy == 0)):
+        curvatures[i] = svgp.CubicBezier(*control_points[i]).curvature(t[i])
+
+    return curvatures
+
+
+def bezier_lengths(control_points):
+    """
+    :param control_points: (N, 4) complex array of segment control points.
+    :return: Array of the arc length of each segment.
+    """
+    count = len(control_points)
+    t = np.tile(GAUSS_LEGENDRE_NODES, count)
+    derivatives = bezier_derivatives(np.repeat(control_points, len(GAUSS_LEGENDRE_NODES), axis=0), t)
+    speeds = np.hypot(derivatives.real, derivatives.imag)
+
+    return speeds.reshape(count, -1).dot(GAUSS_LEGENDRE_WEIGHTS)
+
+
+def bezier_samples(control_points, interval):
+    """
+    :param control_points: (N, 4) complex array of the control points of the consecutive segments of a curve.
+    :param interval: Approximate distance along the curve between samples.
+    :return: Arrays of the segment index and parameter value of each sample. Each segment is sampled from t = 0 in
+             steps of interval / length, excluding t = 1 so that the samples of adjacent segments do not coincide. The
+             end of the final segment is included.
+    """
+    t_steps = interval / bezier_lengths(control_points)
+    counts = np.ceil(1 / t_steps).astype(int)
+
+    segment_indices = np.repeat(np.arange(len(control_points)), counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = steps * t_steps[segment_indices]
+
+    if t[-1] != 1:
+        segment_indices = np.append(segment_indices, len(control_points) - 1)
+        t = np.append(t, 1.0)
+
+    return segment_indices, t
+
+
+def bezier_path_d(control_points):
+    """
+    :param control_points: (N, 4) complex array of segment control points.
+    :return: SVG path data of the segments, with coordinates formatted as by PathFitter.pathtosvg. A segment which
+             starts where the previous segment ends continues the current subpath, otherwise a new subpath is started.
+    """
+    coords = ["%G,%G" % (point.real, point.imag) for point in control_points.ravel().tolist()]
+    starts = control_points[:, 0]
+    new_subpath = np.ones(len(control_points), dtype=bool)
+    new_subpath[1:] = starts[1:] != control_points[:-1, 3]
+
+    d = []
+    for i, (start, control1, control2, end) in enumerate(zip(*[iter(coords)] * 4)):
+        if new_subpath[i]:
+            d += ["M", start]
+        d += ["C", control1, control2, end]
+    return " ".join(d)
+
+
+def thickness_profile(z, diffdir, thickness_parameters):
+    """
+    :param z: Array of depth values along a path.
+    :param diffdir: Array of diffuse lighting values along the path.
+    :param thickness_parameters: ThicknessParameters weighting each component.
+    :return: Array of stroke thickness at each point along the path.
+    """
+    constant_component = thickness_parameters.const
+    z_component = (1 - z) * thickness_parameters.z
+    diffdir_component = (1 - diffdir) * thickness_parameters.diffdir
+
+    return constant_component + z_component + diffdir_component
+
+
+def curvature_profile(primary, norm_z):
+    """
+    :param primary: Array of primary UV image values along a path.
+    :param norm_z: Array of normal z values along the path.
+    :return: Array of absolute first derivatives of the planar magnitudes along the path, with runs of zeros between
+             non-zero values filled by linear interpolation. Where there is at least one non-zero value the result is
+             one longer than the derivatives, ending in zeros.
+    """
+    first_derivatives = np.abs(np.diff(np.hypot(primary, norm_z)))
+    nonzero_indices = np.flatnonzero(first_derivatives)
+
+    # For streamlines with zero curvature along their lengths there is no need to need to continue.
+    if len(nonzero_indices) == 0:
+        return first_derivatives
+
+    # Interpolate between non-zero values, padding either side with zeros.
+    first, last = nonzero_indices[0], nonzero_indices[-1]
+    smoothed = np.zeros(len(first_derivatives) + 1)
+    smoothed[first:last + 1] = np.interp(np.arange(first, last + 1), nonzero_indices,
+                                         first_derivatives[nonzero_indices])
+
+    return smoothed
+
+
+class IsoContours:
+    """
+    Extracts iso-valued contours of an image at many levels. The minimum and maximum value of each square tile of the
+    image is found once, so that only the region of tiles whose range brackets a level need be searched for its
+    contours.
+
+    This only saves time where the contours lie within part of the image, e.g. an uncropped frame with a small object.
+    The tiles along a silhouette span from the background to the object, so bracket almost every level, and the region
+    bounding them is the whole object. Once the surface is cropped to its region of interest, searching this region
+    takes as long as searching the whole image.
+    """
+
+    def __init__(self, image, tile_size=64):
+        self.image = image
+        self.tile_size = tile_size
+
+        # Each tile covers the marching squares cells whose top left corner falls within it, so includes the first row
+        # and column of the following tiles.
+        height, width = image.shape
+        row_starts = np.arange(0, height - 1, tile_size)
+        col_starts = np.arange(0, width - 1, tile_size)
+
+        def tile_extremes(ufunc):
+            rows = ufunc.reduceat(image, row_starts, axis=0)
+            rows[:-1] = ufunc(rows[:-1], image[row_starts[1:]])
+            tiles = ufunc.reduceat(rows, col_starts, axis=1)
+            tiles[:, :-1] = ufunc(tiles[:, :-1], rows[:, col_starts[1:]])
+            return tiles
+
+        self.tile_min = tile_extremes(np.minimum)
+        self.tile_max = tile_extremes(np.maximum)
+
+    def find_contours(self, level):
+        """
+        :return: List of (N, 2) arrays of the (row, column) coordinates of the contours at the level, as found by
+                 measure.find_contours for the whole image.
+        """
+        # Marching squares finds segments only in cells with corners on either side of the level.
+        active = (self.tile_min <= level) & (self.tile_max > level)
+        if not active.any():
+            return []
+
+        # Cells are visited in the same order within any rectangular region of the image, so the contours found in the
+        # region bounding all active tiles are those of the whole image.
+        rows = np.flatnonzero(active.any(axis=1))
+        cols = np.flatnonzero(active.any(axis=0))
+        r0 = rows[0] * self.tile_size
+        c0 = cols[0] * self.tile_size
+        r1 = min((rows[-1] + 1) * self.tile_size, self.image.shape[0] - 1) + 1
+        c1 = min((cols[-1] + 1) * self.tile_size, self.image.shape[1] - 1) + 1
+
+        contours = measure.find_contours(self.image[r0:r1, c0:c1], level)
+        return [contour + (r0, c0) for contour in contours]
+
 
 class Path:
     """
@@ -22,26 +244,48 @@ class Path:
     values at each of these points.
     """
 
+    __slots__ = ("__array", "__points", "__offset_vector", "_curvatures", "__kdtree")
+
     def __init__(self, points, is_rc=False):
 
-        # Points are represented internally as a tuple of (x, y) coordinates.
-        if not is_rc:
-            # Input coordinate are already given in terms of (x, y).
-            self.__points = tuple(tuple(point) for point in points)
-        else:
+        # Points are represented internally as an (N, 2) array of (x, y) coordinates, which is never modified.
+        if not isinstance(points, np.ndarray):
+            points = list(points)
+        array = np.array(points).reshape(-1, 2)
+        if is_rc:
             # Input coordinates are given in terms of (row, column), so swap to (x, y).
-            self.__points = tuple((point[1], point[0]) for point in points)
+            array = array[:, ::-1].copy()
+        array.flags.writeable = False
+        self.__array = array
 
+        # Tuple form of the points, created on first access.
+        self.__points = None
         self.__offset_vector = None
         self._curvatures = None
+        self.__kdtree = None
+
+    def __len__(self):
+        return len(self.__array)
+
+    @property
+    def array(self):
+        """
+        :return: Read-only (N, 2) array of the (x, y) coordinates of the points.
+        """
+        return self.__array
 
     @property
     def points(self):
+        """
+        :return: Tuple of (x, y) coordinates of the points.
+        """
+        if self.__points is None:
+            self.__points = tuple(map(tuple, self.__array.tolist()))
         return self.__points
 
     @property
     def points_as_rc(self):
-        return tuple(((point[1], point[0]) for point in self.__points))
+        return tuple(map(tuple, self.__array[:, ::-1].tolist()))
 
     @property
     def offset_vector(self):
@@ -49,23 +293,46 @@ class Path:
 
     def round(self):
         """
-        :return: New Path containing rounded points.
+        :return: New Path containing rounded points. As with the built-in round, halves are rounded to even.
         """
-        return Path(((int(round(point[0])), int(round(point[1]))) for point in self.__points))
+        return Path(np.round(self.__array).astype(int))
 
-    def nearest_neighbour(self, target_point):
+    @property
+    def kdtree(self):
         """
-        :param target_point:
-        :return: Point on the current Path which is nearest to the specified target_point in Euclidean space.
+        :return: cKDTree of the points, built on first use. Paths are immutable, so the tree never needs rebuilding.
+        """
+        if self.__kdtree is None:
+            self.__kdtree = spatial.cKDTree(self.__array.astype(float))
+        return self.__kdtree
+
+    def nearest_indices(self, target_points):
+        """
+        :param target_points: Sequence of (x, y) coordinates.
+        :return: Array holding, for each target point, the index of the nearest point on the current Path in Euclidean
+                 space. Where several points are equally near, the lowest index is given.
         """
-        distance_map = {}
+        target_points = np.array(target_points, dtype=float).reshape(-1, 2)
+        k = min(2, len(self.__array))
+        distances, indices = self.kdtree.query(target_points, k=k)
+        distances = distances.reshape(len(target_points), k)
+        indices = indices.reshape(len(target_points), k)
 
-        for i, path_point in enumerate(self.__points):
-            distance_map[i] = spatial.distance.euclidean(path_point, target_point)
+        # The tree does not say which of several equidistant points it returns, so where the two nearest are tied,
+        # find all points at the nearest distance and take the first.
+        nearest = indices[:, 0]
+        if k > 1:
+            for i in np.flatnonzero(distances[:, 1] - distances[:, 0] <= 1e-9):
+                nearest[i] = min(self.kdtree.query_ball_point(target_points[i], distances[i, 0] + 1e-9))
 
-        min_loc = min(distance_map, key=distance_map.get)
+        return nearest
 
-        return self.__points[min_loc]
+    def nearest_neighbour(self, target_point):
+        """
+        :param target_point:
+        :return: Point on the current Path which is nearest to the specified target_point in Euclidean space.
+        """
+        return self.points[self.nearest_indices([target_point])[0]]
 
     def find_corners(self, image, min_distance, window_size):
         """
@@ -75,8 +342,10 @@ class Path:
         :return: Points identified as corners.
         """
 
-        # Locate corners, returned values are row/col coordinates (rcs).
-        corner_rcs = corner_peaks(corner_harris(image), min_distance)
+        # Locate corners, returned values are row/col coordinates (rcs). The relative threshold is given explicitly, as
+        # newer versions of skimage no longer default to it; without it the flat background is reported as corners,
+        # making results depend on the extent of the image.
+        corner_rcs = corner_peaks(corner_harris(image), min_distance, threshold_rel=0.1)
         subpix_rcs = corner_subpix(image=image, corners=corner_rcs, window_size=window_size)
 
         corners = []
@@ -103,18 +372,12 @@ class Path:
             corners.append(self.points[-1])
 
         # Identify the index of each corner in this Path.
-        corner_indices = []
-        for corner in corners:
-            corner = self.nearest_neighbour(corner)
-            corner_indices.append(self.__points.index(corner))
-        corner_indices.sort()
+        corner_indices = sorted(self.nearest_indices(corners).tolist())
 
-        # Rebase the list of points to ensure the first point in the list is a corner.
+        # Rebase the points to ensure the first point is a corner.
         rebase_value = corner_indices[0]
         rebased_indices = [x - rebase_value for x in corner_indices]
-        rebased_points = deque(self.__points)
-        rebased_points.rotate(-rebase_value)
-        rebased_points = list(rebased_points)
+        rebased_points = np.roll(self.__array, -rebase_value, axis=0)
 
         # Slice into new separate Path objects. Each Path is demarcated by a corner.
         paths = []
@@ -137,75 +400,34 @@ class Path:
         :return: Path with points adjusted to valid surface locations in image-space.
         """
 
-        points = list(self.__points)
-
-        for i, point in enumerate(points):
-
-            if surface.is_valid(point):
-                continue
-
-            else:
-                # Need to find another pixel nearby which is valid. Due to the nature of find_contours, a pixel
-                # with valid attributes will be found within 1 pixel of the original. So first, identify translations
-                # required to shift pixel position by 1 pixel in each direction.
-                step = 1
-                pixel_translations = [[0, -step],  # N
-                                      [0, step],  # S
-                                      [step, 0],  # E
-                                      [-step, 0],  # W
-                                      [step, -step],  # NE
-                                      [step, step],  # SE
-                                      [-step, step],  # SW
-                                      [-step, -step]]  # NW
-
-                # Now evaluate the surface attributes of each neighbour.
-                for j, pixel_translation in enumerate(pixel_translations):
-                    candidate_point = (point[0] + pixel_translation[0],
-                                       point[1] + pixel_translation[1])
-
-                    try:
-                        if surface.is_valid(candidate_point):
-                            points[i] = candidate_point
-                            # logger.debug("Invalid: %s replaced with: %s", point, candidate_point)
-                            break
-                        elif j == len(pixel_translations) - 1:
-                            # Final loop iteration failed to find a match.
-                            logger.warning("A valid point could not be found!")
-
-                    except (AssertionError, IndexError):
-                        logger.warning("Candidate point out of allowable range: %s", candidate_point)
+        # Need to find another pixel nearby which is valid. Due to the nature of find_contours, a pixel with valid
+        # attributes will usually be found within 1 pixel of the original. The surface maps every pixel to a valid
+        # pixel, preferring the 1 pixel translations N, S, E, W, NE, SE, SW, NW in that order.
+        nearest_rows, nearest_cols = surface.nearest_valid_indices
+        height, width = nearest_rows.shape
+        xs = np.clip(self.__array[:, 0], 0, width - 1)
+        ys = np.clip(self.__array[:, 1], 0, height - 1)
 
-        return Path(points)
+        return Path(np.column_stack((nearest_cols[ys, xs], nearest_rows[ys, xs])))
 
     def bump_z(self, surface):
+        """
+        :return: Path with each point moved to the pixel of least depth within its 3x3 neighbourhood.
+        """
+        codes = surface.z_argmin_offsets[self.__array[:, 1], self.__array[:, 0]].astype(int)
+        xs = self.__array[:, 0] + codes % 3 - 1
+        ys = self.__array[:, 1] + codes // 3 - 1
 
-        points = list(self.__points)
-
-        image = surface.z_image
-
-        window_shape = (3, 3)
-        windows = util.view_as_windows(image, window_shape)
-
-        for i, point in enumerate(points):
-            query_coord = (point[1] - 1, point[0] - 1)
-            local_window = windows[query_coord]
-
-            indices = np.where(local_window == local_window.min())
-            local_coords = indices[0][0], indices[1][0]
-            global_coords = local_coords[0] + query_coord[0], local_coords[1] + query_coord[1]
-
-            points[i] = global_coords[1], global_coords[0]
-
-        return Path(points)
+        return Path(np.column_stack((xs, ys)))
 
     def remove_dupes(self):
         """
-        :return: Path containing only unique points.
+        :return: Path containing only unique points, in order of their first occurrence.
         """
-        points = list(self.__points)
-        unique = tuple(unique_everseen(points))
+        # Adding zero maps -0.0 to 0.0, so that the two compare equal when rows are compared bytewise.
+        _, first_indices = np.unique(self.__array + 0, axis=0, return_index=True)
 
-        return Path(unique)
+        return Path(self.__array[np.sort(first_indices)])
 
     def simple_cull(self, n):
         """
@@ -214,204 +436,216 @@ class Path:
         :return: Path where only the nth points are preserved. The first and last points are always preserved.
         """
 
-        points = list(self.__points)
+        length = len(self.__array)
 
-        keep = []
-        for i in range(0, len(points) - 1):
-            if i % n == 0 and i < ((len(points) - 1) - (n - 1)):
-                keep.append(points[i])
-        keep.append(points[-1])
+        keep = np.arange(0, length - 1, n)
+        keep = np.append(keep[keep < length - n], length - 1)
 
-        return Path(keep)
+        return Path(self.__array[keep])
 
     def optimise(self, n):
-        points = measure.approximate_polygon(np.array(self.__points), n)
+        points = measure.approximate_polygon(self.__array, n)
 
         return Path(points)
 
-    def trim_uv(self, target_intensity, primary_image, secondary_image, primary_trim_size, secondary_trim_size):
-
-        points = list(self.__points)
+    def trim_uv(self, target_intensity, primary_image, secondary_image, primary_trim_size, secondary_trim_size,
+                secondary_range=None):
+        """
+        :param secondary_range: Tuple of the minimum and maximum of secondary_image. If None, these are found from
+                                secondary_image.
+        :return: List of Paths, one for each run of points whose primary value lies within primary_trim_size of the
+                 target intensity and whose secondary value lies at least secondary_trim_size within its range.
+        """
+        points = self.__array
+        xs, ys = points[:, 0], points[:, 1]
 
         min_allowable_primary = target_intensity - primary_trim_size
         max_allowable_primary = target_intensity + primary_trim_size
 
-        min_allowable_secondary = secondary_image.min() + secondary_trim_size
-        max_allowable_secondary = secondary_image.max() - secondary_trim_size
-
-        last_was_accepted = None
-        paths = []
-        continuous_points = []
-        for point in points:
-            if min_allowable_primary <= primary_image[point[1], point[0]] <= max_allowable_primary and \
-                    min_allowable_secondary <= secondary_image[point[1], point[0]] <= max_allowable_secondary:
-                # Accept the point.
-                continuous_points.append(point)
-                last_was_accepted = True
-            else:
-                # Reject the point.
-                if last_was_accepted:
-                    # Create a Path from previously encountered continuous points.
-                    paths.append(Path(continuous_points))
-                    continuous_points.clear()
-                    last_was_accepted = False
+        if secondary_range is None:
+            secondary_range = secondary_image.min(), secondary_image.max()
+        min_allowable_secondary = secondary_range[0] + secondary_trim_size
+        max_allowable_secondary = secondary_range[1] - secondary_trim_size
 
-        # Create a Path from remaining points.
-        if continuous_points:
-            paths.append(Path(continuous_points))
+        primary = primary_image[ys, xs]
+        secondary = secondary_image[ys, xs]
+        accepted = (min_allowable_primary <= primary) & (primary <= max_allowable_primary) & \
+                   (min_allowable_secondary <= secondary) & (secondary <= max_allowable_secondary)
 
-        # logger.debug("Paths after UV trim: %d", len(paths))
+        # Create a Path from each run of continuous accepted points.
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], accepted.view(np.int8), [0]))))
+        paths = [Path(points[start:end]) for start, end in zip(edges[::2], edges[1::2])]
 
         return paths
 
     def compute_curvatures(self, primary_image, surface):
+        points = self.__array
+        primary = primary_image[points[:, 1], points[:, 0]]
+        norm_z = surface.at_points(points[:, 0], points[:, 1], channels=("norm_z",)).norm_z
 
-        # Compute first derivatives of planar magnitudes.
-        first_derivatives = []
-        for i in range(0, len(self.__points) - 1):
-            cur_dim = primary_image[self.__points[i][1], self.__points[i][0]]
-            cur_z = surface.at_point(self.__points[i][0], self.__points[i][1]).norm_z
-            cur_magnitude = math.hypot(cur_dim, cur_z)
+        self._curvatures = curvature_profile(primary, norm_z)
 
-            next_dim = primary_image[self.__points[i + 1][1], self.__points[i + 1][0]]
-            next_z = surface.at_point(self.__points[i + 1][0], self.__points[i + 1][1]).norm_z
-            next_magnitude = math.hypot(next_dim, next_z)
+    def compute_offset_vector(self, surface, thickness_parameters):
+        points = self.__array
+        surface_data = surface.at_points(points[:, 0], points[:, 1], channels=("z", "diffdir"))
+        thickness = thickness_profile(surface_data.z, surface_data.diffdir, thickness_parameters)
 
-            delta = abs(cur_magnitude - next_magnitude)
-            first_derivatives.append(delta)
+        self.__offset_vector = tuple(thickness.tolist())
 
-        first_derivatives = np.array(first_derivatives)
-        nonzero_idx = np.nonzero(first_derivatives)
-        nonzero_vals = first_derivatives[nonzero_idx]
 
-        smoothed = []
+class Curve1D:
+    """
+    A Curve1D object represents a composite Bezier curve which approximates a Path.
 
-        # For streamlines with zero curvature along their lengths there is no need to need to continue.
-        if len(nonzero_idx[0]) == 0:
-            self._curvatures = first_derivatives
-            return
+    The curve is held as an (N, 4) complex array of the control points of its N segments. SVG path data is only
+    formatted when the d attributes are first accessed.
+    """
 
-        # Pad start with zeros as needed.
-        for i in range(0, nonzero_idx[0][0]):
-            smoothed.append(0)
+    def __init__(self, fit_path, settings, curves=None):
+        """
+        :param fit_path: Path to be approximated.
+        :param settings: Settings of the fit.
+        :param curves: Optional (N, 4, 2) array of the control points of a curve already fitted to the Path.
+        """
+        self.fit_path = fit_path
+        self.fit_error = settings.curve_fit_error
+        self.fitter = settings.curve_fitter
 
-        # Interpolate between non-zero values.
-        interp = interp1d(nonzero_idx[0], nonzero_vals)
-        smoothed += [interp(x) for x in range(nonzero_idx[0][0], nonzero_idx[0][-1] + 1)]
+        self.control_points = None
+        self.__d = None
 
-        # Pad end with zeros as needed.
-        for i in range(nonzero_idx[0][-1], len(first_derivatives)):
-            smoothed.append(0)
+        # Points sampled along the curve by the most recent offset, kept to allow plotting for debugging.
+        self.__interval_points = []
 
-        self._curvatures = smoothed
+        self.__generate(curves)
 
-    def compute_offset_vector(self, surface, thickness_parameters):
-        offsets = []
-        for i, point in enumerate(self.points):
-            constant_component = thickness_parameters.const
-            surface_data = surface.at_point(point[0], point[1])
-            z_component = (1 - surface_data.z) * thickness_parameters.z
-            diffdir_component = (1 - surface_data.diffdir) * thickness_parameters.diffdir
+    @staticmethod
+    def fit_all(fit_paths, settings):
+        """
+        Equivalent to creating a Curve1D for each Path, but much faster for many Paths as they are fitted together.
 
-            thickness = constant_component + z_component + diffdir_component
-            offsets.append(thickness)
+        :return: List of Curve1Ds, one for each Path.
+        """
+        if settings.curve_fitter == "paperjs":
+            return [Curve1D(fit_path=fit_path, settings=settings) for fit_path in fit_paths]
 
-        offsets = tuple(offsets)
+        all_curves = fit_curves([fit_path.array for fit_path in fit_paths], settings.curve_fit_error)
+        return [Curve1D(fit_path=fit_path, settings=settings, curves=curves)
+                for fit_path, curves in zip(fit_paths, all_curves)]
 
-        self.__offset_vector = tuple(offsets)
+    @property
+    def segment_count(self):
+        """
+        :return: Number of cubic Bezier segments in the curve.
+        """
+        return len(self.control_points)
 
+    @property
+    def start(self):
+        return self.control_points[0, 0]
 
-class Curve1D:
-    """
-    A Curve1D object represents a composite Bezier curve which approximates a Path.
-    """
+    @property
+    def end(self):
+        return self.control_points[-1, 3]
 
-    def __init__(self, fit_path, settings):
-        self.fit_path = fit_path
-        self.fit_error = settings.curve_fit_error
+    @property
+    def d(self):
+        if self.__d is None:
+            self.__d = bezier_path_d(self.control_points)
+        return self.__d
 
-        self.d = None
-        self.d_c = None
-        self.d_m = None
+    @property
+    def d_m(self):
+        """
+        :return: The initial move-to of the path data.
+        """
+        return self.d[0:self.d.index("C") - 1]
 
-        self.__interval_points = []
-        self.__offset_points = []
+    @property
+    def d_c(self):
+        """
+        :return: The path data following the initial move-to.
+        """
+        return self.d[self.d.index("C"):]
 
-        self.__generate()
+    @property
+    def svgp_path(self):
+        """
+        :return: The curve as an svgpathtools Path, for geometric queries such as intersection.
+        """
+        return svgp.Path(*[svgp.CubicBezier(*segment) for segment in self.control_points.tolist()])
 
-    def __generate(self):
+    def __generate(self, curves):
         logger.debug("Starting path fit...")
 
-        self.d = pf.pathtosvg((pf.fitpath(self.fit_path.points, self.fit_error)))
-
-        # Split the initial move-to from the remainder of the string.
-        curve_start_index = self.d.index("C")
-        self.d_m = self.d[0:curve_start_index - 1]
-        self.d_c = self.d[curve_start_index:]
-
-    def offset(self, interval, hifi_path, thickness_parameters, surface, positive_direction=True):
+        if curves is None:
+            if self.fitter == "paperjs":
+                # The original port of the paper.js fitter, kept for comparison.
+                curves = curves_from_segments(pf.fitpath(self.fit_path.points, self.fit_error))
+            else:
+                curves = fit_curve(self.fit_path.array, self.fit_error)
 
-        self.__offset_points = []
+        if not len(curves):
+            raise ValueError("Path must contain at least two distinct points to be fitted.")
+        self.control_points = curves[:, :, 0] + 1j * curves[:, :, 1]
 
+    def __sample_offsets(self, interval, hifi_path, thickness_parameters, surface):
+        """
+        :return: Complex arrays of the points sampled along the curve, and of the displacement of the positive offset
+                 from each point.
+        """
         hifi_path.compute_offset_vector(surface=surface,
                                         thickness_parameters=thickness_parameters)
-        offset_vector = hifi_path.offset_vector
-
-        # This does not change, so get the factor here rather than in the nested loop down below.
-        stroke_curvature_factor = thickness_parameters.stroke_curvature
+        offset_vector = np.array(hifi_path.offset_vector)
 
         logger.debug("Starting offset...")
-        svg_path = svgp.parse_path(self.d)
-        for i, segment in enumerate(svg_path):
-            # logger.debug("Processing segment: %d/%d", i, len(svg_path))
-            # Determine by how much the segment parametrisation, t, should be incremented between construction Points.
-            # Note: svgpathtools defines t, over the domain 0 <= t <= 1.
-            t_step = interval / segment.length()
-
-            # Generate a list of parameter values. To avoid duplicate construction Points between segments, ensure the
-            # endpoint of a segment (t = 1) is captured only if processing the final segment of the overall
-            # construction curve.
-            t = arange(0, 1, t_step)
-            if i == len(svgp.parse_path(self.d)) - 1 and (1 not in t):
-                t = np.append(t, 1)
-
-            for step in t:
-                # Extract the coordinates at this t-step.
-                interval_point = [segment.point(step).real, segment.point(step).imag]
-                self.__interval_points.append(interval_point)
-                # Sometimes the point will be off the surface due to errors in curve fit. Perform nearest
-                # neighbour to get valid surface attributes, but keep the point coordinates.
-                # TODO: Shouldnt there be a validity check before calling this to avoid unnecessary calls?
-                surface_point = hifi_path.nearest_neighbour(interval_point)
-                surface_idx = hifi_path.points.index(surface_point)
-                thickness = offset_vector[surface_idx]
-
-                if stroke_curvature_factor:
-                    curvature = segment.curvature(step)
-                    thickness += stroke_curvature_factor * curvature
-
-                if thickness == 0:
-                    # Zero thickness causes problems with svgpathtools, so enforce a minimum thickness close to zero.
-                    thickness = 1e-03
-
-                # Compute offset coordinates for each side (a and b) of the t-step.
-                normal = segment.normal(step)
-
-                if positive_direction:
-                    dir = 1
-                else:
-                    dir = -1
-
-                offset_coord = segment.point(step) + (thickness * normal * dir)
-                offset_point = [offset_coord.real, offset_coord.imag]
-                self.__offset_points.append(offset_point)
-
-        if not positive_direction:
-            offset_points = np.array(self.__offset_points)
+        control_points = self.control_points
+
+        # Sample all segments at once, at roughly equal intervals along the construction curve.
+        segment_indices, t = bezier_samples(control_points, interval)
+        sample_control_points = control_points[segment_indices]
+        interval_points = bezier_points(sample_control_points, t)
+        interval_coords = np.column_stack((interval_points.real, interval_points.imag))
+        self.__interval_points = interval_coords.tolist()
+
+        # Sometimes a point will be off the surface due to errors in curve fit. Find the nearest point of hifi_path to
+        # get valid surface attributes, but keep the point coordinates.
+        thickness = offset_vector[hifi_path.nearest_indices(interval_coords)]
+
+        if thickness_parameters.stroke_curvature:
+            thickness = thickness + thickness_parameters.stroke_curvature * bezier_curvatures(sample_control_points, t)
+
+        # Zero thickness causes problems with svgpathtools, so enforce a minimum thickness close to zero.
+        thickness[thickness == 0] = 1e-03
+
+        return interval_points, thickness * bezier_normals(sample_control_points, t)
+
+    @staticmethod
+    def __offset_path(interval_points, displacements, direction):
+        offset_coords = interval_points + displacements * direction
+        offset_points = np.column_stack((offset_coords.real, offset_coords.imag))
+
+        # The negative side is reversed, so that it follows on from the end of the positive side.
+        if direction < 0:
             offset_points = np.flip(offset_points, 0)
-            self.__offset_points = list(offset_points)
 
-        return Path(self.__offset_points)
+        return Path(offset_points)
+
+    def offset(self, interval, hifi_path, thickness_parameters, surface, positive_direction=True):
+        interval_points, displacements = self.__sample_offsets(interval, hifi_path, thickness_parameters, surface)
+
+        return self.__offset_path(interval_points, displacements, 1 if positive_direction else -1)
+
+    def offset_both(self, interval, hifi_path, thickness_parameters, surface):
+        """
+        Equivalent to calling offset in each direction, but sampling the curve only once.
+
+        :return: Tuple of the offset Paths in the positive and negative directions.
+        """
+        interval_points, displacements = self.__sample_offsets(interval, hifi_path, thickness_parameters, surface)
+
+        return (self.__offset_path(interval_points, displacements, 1),
+                self.__offset_path(interval_points, displacements, -1))
 
 
 class CurvedStroke:
@@ -419,47 +653,64 @@ class CurvedStroke:
         self.upper_curve = upper_curve
         self.lower_curve = lower_curve
 
+        self.r1 = None
+        self.r2 = None
+        self.__d = None
+
         self.__generate()
 
+    @property
+    def segment_count(self):
+        """
+        :return: Number of cubic Bezier segments in the stroke outline.
+        """
+        return self.upper_curve.segment_count + self.lower_curve.segment_count
+
+    @property
+    def d(self):
+        if self.__d is None:
+            self.__d = self.__generate_d()
+        return self.__d
+
     def __generate(self):
         logger.debug("Starting generate...")
-        upper_curve = svgp.parse_path(self.upper_curve.d)
-        upper_curve_start = (upper_curve.start.real,
-                             upper_curve.start.imag)
-        upper_curve_end = (upper_curve.end.real,
-                           upper_curve.end.imag)
+        upper_curve_start = (self.upper_curve.start.real,
+                             self.upper_curve.start.imag)
+        upper_curve_end = (self.upper_curve.end.real,
+                           self.upper_curve.end.imag)
 
-        lower_curve = svgp.parse_path(self.lower_curve.d)
-        lower_curve_start = (lower_curve.start.real,
-                             lower_curve.start.imag)
-        lower_curve_end = (lower_curve.end.real,
-                           lower_curve.end.imag)
+        lower_curve_start = (self.lower_curve.start.real,
+                             self.lower_curve.start.imag)
+        lower_curve_end = (self.lower_curve.end.real,
+                           self.lower_curve.end.imag)
 
-        r1 = spatial.distance.euclidean(upper_curve_end, lower_curve_start) / 2
-        r2 = spatial.distance.euclidean(lower_curve_end, upper_curve_start) / 2
+        self.r1 = spatial.distance.euclidean(upper_curve_end, lower_curve_start) / 2
+        self.r2 = spatial.distance.euclidean(lower_curve_end, upper_curve_start) / 2
 
+    def __generate_d(self):
         p = svgwrite.path.Path()
         p.push(self.upper_curve.d)
 
+        # Arc end points are formatted as the curves are, so that each arc meets the following curve exactly.
         p.push("A",
-               r1, r1,
+               self.r1, self.r1,
                0,
                1, 1,
-               lower_curve_start[0], lower_curve_start[1])
+               "%G" % self.lower_curve.start.real, "%G" % self.lower_curve.start.imag)
 
         p.push(self.lower_curve.d_c)
 
         p.push("A",
-               r2, r2,
+               self.r2, self.r2,
                0,
                1, 1,
-               upper_curve_start[0], upper_curve_start[1])
+               "%G" % self.upper_curve.start.real, "%G" % self.upper_curve.start.imag)
 
         p.push("Z")
 
         # Call to either tostring or to_xml() is needed to create the dict 'd' attribute.
         p.tostring()
-        self.d = p.attribs['d']
+        return p.attribs['d']
 
 
 class DirectionalStippleStroke:
@@ -475,9 +726,21 @@ class DirectionalStippleStroke:
         self.heading = heading
 
         self.d = None
+        self.vertices = None
 
         self.__generate()
 
+    @property
+    def svgp_path(self):
+        """
+        :return: The stroke outline as an svgpathtools Path, for geometric queries such as intersection.
+        """
+        v0, v1, v2, v3 = [complex(x, y) for x, y in self.vertices.tolist()]
+        return svgp.Path(svgp.Line(v0, v1),
+                         svgp.Arc(v1, complex(self.r1, self.r1), 0, False, False, v2),
+                         svgp.Line(v2, v3),
+                         svgp.Arc(v3, complex(self.r0, self.r0), 0, False, False, v0))
+
     def __translate(self, vertices, x, y):
         """
         Translate a list of vertices by x, y.
@@ -574,6 +837,7 @@ class DirectionalStippleStroke:
 
         # Rotate around p0 to achieve final position.
         vertices = self.__rotate_about_xy(vertices, self.p0[0], self.p0[1], self.heading)
+        self.vertices = vertices
 
         p = svgwrite.path.Path()
 
@@ -178,11 +178,18 @@ class RenderNPR(bpy.types.Operator):
                             cull_factor=20,
                             optimise_factor=5,
                             curve_fit_error=0.01,
+                            curve_fitter="numpy",
                             subpix_window_size=20,
                             curve_sampling_interval=20,
                             stroke_colour="black",
                             uv_primary_trim_size=200,
-                            uv_secondary_trim_size=20)
+                            uv_secondary_trim_size=20,
+                            load_workers=None,
+                            streamline_workers=1,
+                            cache_passes=True,
+                            compact_surface=False,
+                            roi_padding=32,
+                            write_report=False)
 
         logger.debug("Starting illustrator...")
         try:
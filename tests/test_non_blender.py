@@ -1,11 +1,29 @@
 import unittest
+from unittest import mock
 import logging
+import multiprocessing
+import os
+import tempfile
 
+import imageio
 import numpy as np
+import svgpathtools as svgp
+import svgwrite
+from scipy import spatial
 from skimage import draw, measure
 
-from blender_hand_drawn_npr.model.data import Surface, ThicknessParameters
-from blender_hand_drawn_npr.model.primitives import Path
+from blender_hand_drawn_npr.model import batch, data
+from blender_hand_drawn_npr.model.batch import discover_frames, frame_filepath
+from blender_hand_drawn_npr.model.data import Surface, ThicknessParameters, CACHE_DIRNAME, settings_from_dict
+from blender_hand_drawn_npr.model.elements import Streamlines, Stipples
+from blender_hand_drawn_npr.model.fitting import fit_curve, fit_curves
+from blender_hand_drawn_npr.model.illustrate import Illustrator, PASS_FILENAMES
+from blender_hand_drawn_npr.model.instrumentation import Instrumentation, children_cpu_time, peak_rss
+from blender_hand_drawn_npr.model.node_placement import moving_front_nodes
+from blender_hand_drawn_npr.model.primitives import Path, Curve1D, DirectionalStippleStroke, IsoContours, \
+    curvature_profile, bezier_points, bezier_normals, bezier_curvatures, bezier_lengths, bezier_path_d
+from blender_hand_drawn_npr.model.third_party import PathFitter as pf
+from blender_hand_drawn_npr.model.third_party import variable_density
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +74,13 @@ class TestPath(unittest.TestCase):
         self.assertEqual((7, 7), self.edge_path.nearest_neighbour([9, 9]))
         self.assertEqual((2, 7), self.edge_path.nearest_neighbour([0, 9]))
 
+    def test_nearest_indices(self):
+        indices = self.edge_path.nearest_indices([[0, 0], [9, 0], [4, 4.5]])
+
+        self.assertEqual([0, 5, 17], indices.tolist())
+        # Equidistant points resolve to the first on the Path.
+        self.assertEqual([0], Path([[0, 0], [2, 0], [0, 0]]).nearest_indices([[1, 0]]).tolist())
+
     def test_find_corners(self):
         corners = self.edge_path.find_corners(self.surface.obj_image,
                                               min_distance=1,
@@ -86,6 +111,24 @@ class TestPath(unittest.TestCase):
                           (2, 7), (2, 7), (2, 7), (2, 6), (2, 5), (2, 4), (2, 3), (2, 2)),
                          bumped.points)
 
+    def test_bump_distant(self):
+        # Points more than one pixel from the square are moved to the nearest point on it.
+        bumped = Path([[0, 4], [9, 9], [4, 4]]).bump(self.surface)
+
+        self.assertEqual(((2, 4), (7, 7), (4, 4)), bumped.points)
+
+    def test_bump_z(self):
+        z_image = np.array([[5, 4, 4, 9],
+                            [3, 6, 2, 9],
+                            [3, 7, 8, 2],
+                            [9, 9, 1, 0]])
+        surface = Surface(z_image=z_image)
+
+        # Ties are resolved in favour of the first in row-major order. Windows at the border are clipped to the image.
+        bumped = Path([[1, 1], [0, 0], [3, 0], [0, 2], [3, 3]]).bump_z(surface)
+
+        self.assertEqual(((2, 1), (0, 1), (2, 1), (0, 1), (3, 3)), bumped.points)
+
     def test_simple_cull(self):
         path = Path(((0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0)))
 
@@ -94,13 +137,249 @@ class TestPath(unittest.TestCase):
         self.assertEqual(((0, 0), (3, 0), (7, 0)), path.simple_cull(3).points)
         self.assertEqual(((0, 0), (7, 0)), path.simple_cull(4).points)
 
+    def test_curvature_profile(self):
+        # Magnitudes 1, 1, 2, 2, 2, 5, 5 have non-zero derivatives at 1 and 4; the gap between is interpolated.
+        profile = curvature_profile(np.array([1, 1, 2, 2, 2, 5, 5]), np.zeros(7))
+
+        np.testing.assert_allclose([0, 1, 5 / 3, 7 / 3, 3, 0, 0], profile)
+
+    def test_remove_dupes(self):
+        path = Path(((3, 1), (1, 1), (3, 1), (2, 2), (1, 1), (0, 0)))
+
+        self.assertEqual(((3, 1), (1, 1), (2, 2), (0, 0)), path.remove_dupes().points)
+
+    def test_trim_uv(self):
+        primary_image = np.full((3, 8), 10)
+        primary_image[1, 3] = 50
+        secondary_image = np.tile(np.arange(8), (3, 1))
+        path = Path([[x, 1] for x in range(8)])
+
+        paths = path.trim_uv(target_intensity=10, primary_image=primary_image, secondary_image=secondary_image,
+                             primary_trim_size=5, secondary_trim_size=1)
+
+        self.assertEqual([((1, 1), (2, 1)), ((4, 1), (5, 1), (6, 1))], [path.points for path in paths])
+
+        # A given secondary range is used in place of that of the secondary image.
+        paths = path.trim_uv(target_intensity=10, primary_image=primary_image, secondary_image=secondary_image,
+                             primary_trim_size=5, secondary_trim_size=1, secondary_range=(1, 7))
+
+        self.assertEqual([((2, 1),), ((4, 1), (5, 1), (6, 1))], [path.points for path in paths])
+
+
+class TestIsoContours(unittest.TestCase):
+    def test_find_contours(self):
+        # Several peaks of differing height, so that most levels are bracketed by only some of the tiles.
+        rows, cols = np.mgrid[0:50, 0:70]
+        image = np.zeros((50, 70))
+        for row, col, height in ((10, 10, 1), (35, 20, 0.6), (20, 55, 0.8), (45, 65, 0.3)):
+            image += height * np.exp(-((rows - row) ** 2 + (cols - col) ** 2) / 40)
+        iso_contours = IsoContours(image, tile_size=8)
+
+        for level in (0.05, 0.2, 0.5, 0.7, 0.95, 2):
+            expected = measure.find_contours(image, level)
+            actual = iso_contours.find_contours(level)
+            self.assertEqual(len(expected), len(actual))
+            for expected_contour, actual_contour in zip(expected, actual):
+                np.testing.assert_allclose(expected_contour, actual_contour)
+
 
 class TestStroke(unittest.TestCase):
-    pass
+
+    def test_bezier_evaluation(self):
+        segments = [svgp.CubicBezier(0j, 10 + 20j, 30 - 5j, 40 + 10j),
+                     svgp.CubicBezier(40 + 10j, 50 + 15j, 45 + 30j, 20 + 40j)]
+        control_points = np.array([segment.bpoints() for segment in segments] * 3)
+        t = np.array([0, 0, 0.25, 0.5, 1, 1])
+
+        for i, segment in enumerate(segments * 3):
+            self.assertEqual(segment.point(t[i]), bezier_points(control_points, t)[i])
+            self.assertEqual(segment.normal(t[i]), bezier_normals(control_points, t)[i])
+            self.assertAlmostEqual(segment.curvature(t[i]), bezier_curvatures(control_points, t)[i], places=12)
+            self.assertAlmostEqual(segment.length(), bezier_lengths(control_points)[i], places=9)
+
+    def test_fit_curve(self):
+        random_state = np.random.RandomState(0)
+        angles = np.linspace(0, 5, 120)
+        circle = np.column_stack([100 * np.cos(angles), 100 * np.sin(angles)])
+        noisy_circle = circle + random_state.normal(0, 2, circle.shape)
+        paths = [[[256, 318], [258, 276], [258, 276], [272, 240], [294, 220], [340, 213], [382, 227]],
+                 circle.tolist(),
+                 noisy_circle.tolist(),
+                 np.round(noisy_circle).astype(int).tolist()]
+
+        for error in (0.01, 1, 5):
+            for points in paths:
+                curves = fit_curve(points, error)
+                self.assertEqual(pf.pathtosvg(pf.fitpath(points, error)),
+                                 bezier_path_d(curves[:, :, 0] + 1j * curves[:, :, 1]))
+                np.testing.assert_array_equal(curves[1:, 0], curves[:-1, 3])
+
+            # Fitting paths together gives the same curves as fitting each alone.
+            batch = paths + [[[1, 2], [1, 2]], [], [[0, 0], [3, 4]]]
+            for points, curves in zip(batch, fit_curves(batch, error)):
+                np.testing.assert_array_equal(fit_curve(points, error), curves)
+
+        self.assertEqual((0, 4, 2), fit_curve([[1, 2], [1, 2]], 1).shape)
+
+    def test_curve_control_points(self):
+        fit_path = Path([[256, 318], [258, 276], [272, 240], [294, 220], [340, 213], [382, 227]])
+        curve = Curve1D(fit_path=fit_path, settings=settings_from_dict({"curve_fit_error": 1}))
+        paperjs_curve = Curve1D(fit_path=fit_path, settings=settings_from_dict({"curve_fit_error": 1,
+                                                                                "curve_fitter": "paperjs"}))
+
+        np.testing.assert_array_equal(paperjs_curve.control_points, curve.control_points)
+        self.assertEqual(pf.pathtosvg(pf.fitpath(fit_path.points, 1)), curve.d)
+        self.assertEqual(curve.d, curve.d_m + " " + curve.d_c)
+        self.assertEqual(curve.segment_count, len(svgp.parse_path(curve.d)))
+
+        # Segments which do not join start a new subpath.
+        control_points = np.array([[0, 1, 2, 3], [3, 4, 5, 6], [7, 8, 9, 10]], dtype=complex)
+        self.assertEqual("M 0,0 C 1,0 2,0 3,0 C 4,0 5,0 6,0 M 7,0 C 8,0 9,0 10,0", bezier_path_d(control_points))
+
+    def test_stipple_path(self):
+        stipple = DirectionalStippleStroke(length=20, r0=2, r1=0, p0=(10, 15), heading=30)
+
+        self.assertEqual(svgp.parse_path(stipple.d), stipple.svgp_path)
+
+    def test_offset_both(self):
+        fake_image = np.zeros((40, 40))
+        fake_image[5:35, 5:35] = 0.5
+        surface = Surface(obj_image=fake_image, z_image=fake_image, diffdir_image=fake_image)
+        settings = settings_from_dict({})
+        thickness_parameters = ThicknessParameters(const=1, z=2, diffdir=0, stroke_curvature=0.5)
+        hifi_path = Path([[x, 10 + x // 4] for x in range(5, 35)])
+        curve = Curve1D(fit_path=hifi_path.optimise(1), settings=settings)
+
+        upper_path, lower_path = curve.offset_both(5, hifi_path, thickness_parameters, surface)
+
+        self.assertEqual(curve.offset(5, hifi_path, thickness_parameters, surface).points, upper_path.points)
+        self.assertEqual(curve.offset(5, hifi_path, thickness_parameters, surface, positive_direction=False).points,
+                         lower_path.points)
 
 
 class TestSurface(unittest.TestCase):
-    pass
+
+    def test_at_points(self):
+        image = np.arange(100, dtype=float).reshape((10, 10))
+        surface = Surface(obj_image=image, z_image=image, diffdir_image=image, norm_x_image=image,
+                          norm_y_image=image, norm_z_image=image, u_image=image, v_image=image)
+
+        surface_data = surface.at_points([0, 3.7, 9], [0, 2, 5])
+
+        np.testing.assert_array_equal([0, 23, 59], surface_data.z)
+        for i, (x, y) in enumerate(((0, 0), (3.7, 2), (9, 5))):
+            self.assertEqual(surface.at_point(x, y).z, surface_data.z[i])
+        with self.assertRaises(AssertionError):
+            surface.at_points([10], [0])
+
+    def test_channel_range(self):
+        image = np.arange(100, dtype=float).reshape((10, 10))
+        surface = Surface(obj_image=image, u_image=image)
+
+        self.assertEqual((0, 99), surface.channel_range("u"))
+        surface.u_image = image * 2
+        self.assertEqual((0, 198), surface.channel_range("u"))
+
+    def test_compact(self):
+        obj_image = np.zeros((10, 10))
+        obj_image[2:7, 2:7] = 1
+        u_image = np.full((10, 10), 65535, dtype=np.uint16)
+        surface = Surface(obj_image=obj_image, z_image=obj_image.copy(), u_image=u_image)
+        footprint = surface.nbytes
+
+        surface.compact()
+
+        self.assertEqual((10, 10, 3), surface.channels.shape)
+        self.assertEqual(np.float32, surface.channels.dtype)
+        self.assertTrue(np.shares_memory(surface.channels, surface.u_image))
+        np.testing.assert_array_equal(obj_image, surface.obj_image)
+        np.testing.assert_array_equal(u_image, surface.u_image)
+        self.assertLess(surface.nbytes, footprint)
+
+    def test_lazy_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "Shadow0001.png")
+            imageio.imwrite(file_path, np.full((10, 10, 3), 255, dtype=np.uint8))
+
+            surface = Surface()
+            surface.add_pass_files({"shadow": file_path})
+            self.assertEqual((), surface.loaded_channels)
+
+            self.assertEqual((10, 10), surface.shadow_image.shape)
+            self.assertEqual(("shadow",), surface.loaded_channels)
+
+    def test_cached_image(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "Depth0001.png")
+            image = np.zeros((10, 10, 3), dtype=np.uint8)
+            image[2:7, 2:7] = 255
+            imageio.imwrite(file_path, image)
+
+            decoded = Surface(use_cache=True)
+            decoded.init_z_image(file_path)
+            cache_files = os.listdir(os.path.join(tmp_dir, CACHE_DIRNAME))
+            self.assertEqual(1, len(cache_files))
+            # The cache holds the image as decoded, not converted to float.
+            self.assertEqual(np.uint8, np.load(os.path.join(tmp_dir, CACHE_DIRNAME, cache_files[0])).dtype)
+
+            # A second load of the unchanged image is served from the cache.
+            cached = Surface(use_cache=True)
+            decode = mock.Mock(side_effect=AssertionError("Image decoded again."))
+            with mock.patch.object(data, "GRAY", (decode, data.to_gray)):
+                cached.init_z_image(file_path)
+            np.testing.assert_array_equal(decoded.z_image, cached.z_image)
+            self.assertEqual(decoded.z_image.dtype, cached.z_image.dtype)
+
+    def test_compact_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Single channel images need no conversion, so remain memory-mapped from the cache.
+            file_path = os.path.join(tmp_dir, "IndexOB0001.png")
+            imageio.imwrite(file_path, np.full((10, 10), 255, dtype=np.uint8))
+            Surface(use_cache=True).init_obj_image(file_path)
+
+            cached = Surface(use_cache=True)
+            cached.init_obj_image(file_path)
+            self.assertIsInstance(cached.obj_image, np.memmap)
+
+            # Memory-mapped channels are left as they are, rather than copied into memory.
+            cached.compact()
+            self.assertIsNone(cached.channels)
+            self.assertIsInstance(cached.obj_image, np.memmap)
+            del cached
+
+    def test_init_images(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rows, cols = np.mgrid[0:20, 0:30]
+            file_paths = {"obj": os.path.join(tmp_dir, "IndexOB0001.png"),
+                          "z": os.path.join(tmp_dir, "Depth0001.png"),
+                          "diffdir": os.path.join(tmp_dir, "DiffDir0001.png"),
+                          "norm": os.path.join(tmp_dir, "Normal0001.tif"),
+                          "uv": os.path.join(tmp_dir, "UV0001.tif")}
+            imageio.imwrite(file_paths["obj"], np.dstack([(rows > 5).astype(np.uint8) * 255] * 3))
+            imageio.imwrite(file_paths["z"], np.dstack([(rows * 10).astype(np.uint8)] * 3))
+            imageio.imwrite(file_paths["diffdir"], np.dstack([(cols * 8).astype(np.uint8)] * 3))
+            imageio.imwrite(file_paths["norm"],
+                            np.dstack([rows * 3000, cols * 2000, rows * cols * 100]).astype(np.uint16))
+            imageio.imwrite(file_paths["uv"], np.dstack([cols * 2000, rows * 3000, rows * 0]).astype(np.uint16))
+
+            serial = Surface()
+            serial.init_images(file_paths, max_workers=1)
+            concurrent = Surface()
+            concurrent.init_images(file_paths, max_workers=4)
+
+            self.assertEqual(serial.loaded_channels, concurrent.loaded_channels)
+            for name in serial.loaded_channels:
+                np.testing.assert_array_equal(serial.get_image(name), concurrent.get_image(name))
+
+            # An error loading any one pass is raised to the caller.
+            with self.assertRaises(FileNotFoundError):
+                Surface().init_images(dict(file_paths, z=os.path.join(tmp_dir, "Missing0001.png")), max_workers=4)
+
+    def test_compact_empty(self):
+        surface = Surface()
+        surface.compact()
+
+        self.assertIsNone(surface.channels)
 
 
 class TestSilhouette(unittest.TestCase):
@@ -108,4 +387,196 @@ class TestSilhouette(unittest.TestCase):
 
 
 class TestIllustrator(unittest.TestCase):
-    pass
+
+    def test_region_of_interest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # A disc away from the centre of the frame, so that the region is offset in both directions.
+            rows, cols = np.mgrid[0:150, 0:200]
+            disc = (rows - 60) ** 2 + (cols - 120) ** 2 <= 30 ** 2
+            for name, image in (("obj", disc * 255), ("z", np.where(disc, 100 + rows // 2, 255)),
+                                ("diffdir", disc * (cols + 50))):
+                imageio.imwrite(os.path.join(tmp_dir, PASS_FILENAMES[name].format(1)),
+                                np.dstack([image.astype(np.uint8)] * 3))
+
+            settings = settings_from_dict({"roi_padding": 5, "harris_min_distance": 20, "cache_passes": False,
+                                           "write_report": False, "in_path": tmp_dir,
+                                           "out_filepath": os.path.join(tmp_dir, "out.svg")})
+            cropped = Illustrator(settings)
+            cropped.illustrate()
+            full = Illustrator(settings._replace(roi_padding=None))
+            full.illustrate()
+
+        # The disc spans rows 30 to 90 and columns 90 to 150, padded by at least the Harris min_distance.
+        self.assertEqual((10, 70, 111, 171), cropped.surface.region)
+        self.assertEqual((101, 101), cropped.surface.obj_image.shape)
+        self.assertIsNone(full.surface.region)
+
+        # Strokes of the cropped surface are translated back to where they lie in the full frame.
+        self.assertEqual("translate(70, 10)", cropped.layer["transform"])
+        cropped_paths = [svgp.parse_path(stroke.get_xml().get("d")).translated(complex(70, 10))
+                         for stroke in cropped.layer.elements]
+        full_paths = [svgp.parse_path(stroke.get_xml().get("d")) for stroke in full.layer.elements
+                      if isinstance(stroke, svgwrite.path.Path)]
+        self.assertLess(0, len(full_paths))
+        self.assertEqual(len(full_paths), len(cropped_paths))
+        for cropped_path, full_path in zip(cropped_paths, full_paths):
+            self.assertEqual(len(full_path), len(cropped_path))
+            for cropped_segment, full_segment in zip(cropped_path, full_path):
+                np.testing.assert_allclose([cropped_segment.start, cropped_segment.end],
+                                           [full_segment.start, full_segment.end], atol=1e-2)
+
+
+class TestNodePlacement(unittest.TestCase):
+
+    def test_moving_front_nodes(self):
+        # Radius increasing from left to right.
+        radius_image = np.tile(2 + np.arange(120) / 30, (80, 1))
+
+        def spacing(nodes):
+            distances, _ = spatial.cKDTree(nodes).query(nodes, k=2)
+            rows, cols = np.round(nodes).astype(int).T[::-1]
+            return np.median(distances[:, 1] / radius_image[rows, cols])
+
+        np.random.seed(0)
+        expected = variable_density.moving_front_nodes(
+            lambda x, y: 1 / radius_image[int(round(y)), int(round(x))] ** 2, (0, 0, 119, 79))
+        np.random.seed(0)
+        nodes = moving_front_nodes(radius_image)
+
+        self.assertTrue(np.all((0 <= nodes) & (nodes <= (119, 79))))
+        self.assertAlmostEqual(1, len(nodes) / len(expected), delta=0.05)
+        self.assertAlmostEqual(spacing(expected), spacing(nodes), delta=0.05)
+        # Denser on the left, where the radius is smaller.
+        self.assertGreater(np.sum(nodes[:, 0] < 60), 1.5 * np.sum(nodes[:, 0] >= 60))
+
+
+class TestStreamlines(unittest.TestCase):
+
+    def test_parallel(self):
+        rows, cols = np.mgrid[0:120, 0:160] / 100
+        obj_image = ((rows - 0.6) ** 2 + (cols - 0.8) ** 2 < 0.25).astype(float)
+        surface = Surface(obj_image=obj_image, z_image=obj_image * 0.5, diffdir_image=obj_image * 0.8,
+                          norm_x_image=obj_image * 0.5, norm_y_image=obj_image * 0.5, norm_z_image=obj_image,
+                          u_image=cols * obj_image, v_image=rows * obj_image)
+        settings = settings_from_dict({"streamline_segments": 6, "uv_primary_trim_size": 0.5,
+                                       "uv_secondary_trim_size": 0.02})
+
+        serial = Streamlines(surface, settings._replace(streamline_workers=1))
+        serial.generate()
+        parallel = Streamlines(surface, settings._replace(streamline_workers=3))
+        parallel.generate()
+
+        self.assertLess(0, len(serial.svg_strokes))
+        self.assertEqual([stroke.tostring() for stroke in serial.svg_strokes],
+                         [stroke.tostring() for stroke in parallel.svg_strokes])
+        self.assertEqual(serial.counts, parallel.counts)
+
+
+class TestStipples(unittest.TestCase):
+
+    def test_radius_reuse(self):
+        rows, cols = np.mgrid[0:60, 0:80] / 50
+        obj_image = ((rows - 0.6) ** 2 + (cols - 0.8) ** 2 < 0.25).astype(float)
+        surface = Surface(obj_image=obj_image, diffdir_image=cols * obj_image, shadow_image=obj_image,
+                          ao_image=obj_image, u_image=cols * obj_image, v_image=rows * obj_image)
+        settings = settings_from_dict({"stipple_parameters": {"density_fn_min": 0.02, "density_fn_factor": 0.1}})
+        clip_path = svgwrite.Drawing().clipPath()
+
+        stipples = Stipples(clip_path, [], surface, settings)
+        stipples.generate()
+        np.testing.assert_allclose(1 / np.sqrt(np.maximum(0.02, stipples.reference_image * 0.1)),
+                                   stipples.radius_image)
+
+        # A change of threshold alone reuses the radius image, but a change of density function does not.
+        lighting_parameters = settings.lighting_parameters._replace(threshold=0.5)
+        thresholded = Stipples(clip_path, [], surface, settings._replace(lighting_parameters=lighting_parameters))
+        thresholded.generate()
+        self.assertIs(stipples.radius_image, thresholded.radius_image)
+        self.assertLess(thresholded.counts["stipples"], stipples.counts["stipples"])
+
+        stipple_parameters = settings.stipple_parameters._replace(density_fn_factor=0.2)
+        denser = Stipples(clip_path, [], surface, settings._replace(stipple_parameters=stipple_parameters))
+        denser.generate()
+        self.assertIs(stipples.reference_image, denser.reference_image)
+        self.assertIsNot(stipples.radius_image, denser.radius_image)
+
+
+class TestSettings(unittest.TestCase):
+
+    def test_settings_from_dict(self):
+        settings = settings_from_dict({"cull_factor": 5,
+                                       "silhouette_thickness_parameters": {"z": 3}})
+
+        self.assertEqual(5, settings.cull_factor)
+        self.assertEqual(ThicknessParameters(const=1, z=3, diffdir=0, stroke_curvature=0),
+                         settings.silhouette_thickness_parameters)
+        self.assertEqual(0.01, settings.curve_fit_error)
+        with self.assertRaises(ValueError):
+            settings_from_dict({"cull": 5})
+        with self.assertRaises(ValueError):
+            settings_from_dict({"lighting_parameters": 3})
+        with self.assertRaises(ValueError):
+            settings_from_dict({"lighting_parameters": [["ao", 2]]})
+        with self.assertRaises(ValueError):
+            settings_from_dict([["cull_factor", 5]])
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_discover_frames(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for file_name in ("IndexOB0012.png", "IndexOB0003.png", "Depth0004.png", "IndexOB0005.tif"):
+                open(os.path.join(tmp_dir, file_name), "w").close()
+
+            self.assertEqual([3, 12], discover_frames(tmp_dir))
+
+    def test_frame_filepath(self):
+        self.assertEqual("/tmp/out_0007.svg", frame_filepath("/tmp/out.svg", 7))
+        self.assertEqual("/tmp/out_07.svg", frame_filepath("/tmp/out_##.svg", 7))
+        self.assertEqual("/tmp/out_1234.svg", frame_filepath("/tmp/out_##.svg", 1234))
+
+    def test_single_job_in_process(self):
+        # Frames run in this process, rather than a daemonic pool worker, may start worker processes of their own.
+        with mock.patch.object(batch, "illustrate_frame", lambda job: multiprocessing.current_process().daemon):
+            self.assertEqual([False], batch.illustrate_jobs([(None, 1)], processes=4).out_filepaths)
+            self.assertEqual([False, False], batch.illustrate_jobs([(None, 1), (None, 2)], processes=1).out_filepaths)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_stages(self):
+        instrumentation = Instrumentation()
+        with instrumentation.stage("silhouette") as counts:
+            counts["strokes"] += 3
+        with instrumentation.stage("streamlines") as counts:
+            counts.update({"strokes": 2, "paths": 4})
+
+        report = instrumentation.report(frame=1)
+        self.assertEqual(1, report["frame"])
+        self.assertEqual(["silhouette", "streamlines"], list(report["stages"]))
+        self.assertEqual({"strokes": 5, "paths": 4}, report["counts"])
+        self.assertGreaterEqual(report["stages"]["silhouette"]["wall_time"], 0)
+
+    @unittest.skipIf(peak_rss() is None, "Peak memory is not available on this platform.")
+    def test_peak_rss_increase(self):
+        instrumentation = Instrumentation()
+        with instrumentation.stage("allocate"):
+            # Touch enough memory to raise the peak of this process, whatever it was before the stage.
+            np.ones(peak_rss() // 8 + 2 ** 20)
+        with instrumentation.stage("reuse"):
+            np.ones(2 ** 20)
+
+        self.assertGreater(instrumentation.stages["allocate"]["peak_rss_increase"], 0)
+        self.assertEqual(0, instrumentation.stages["reuse"]["peak_rss_increase"])
+
+    @unittest.skipIf(children_cpu_time() is None, "Child CPU time is not available on this platform.")
+    def test_children_cpu_time(self):
+        instrumentation = Instrumentation()
+        with instrumentation.stage("workers"):
+            with multiprocessing.Pool(processes=2) as pool:
+                pool.map(sum, [range(10 ** 6)] * 4)
+                pool.close()
+                pool.join()
+
+        self.assertGreater(instrumentation.stages["workers"]["children_cpu_time"], 0)
+        self.assertGreaterEqual(instrumentation.stages["workers"]["children_peak_rss_increase"], 0)